@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Description: Benchmark suite of prokka2vep. It generates deterministic, realistic prokka GFF3 files
+and times every stage of the conversion (with prokka2vep --profile) for each input size and engine.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+PROKKA2VEP = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prokka2vep.py')
+
+PRODUCTS = [
+    'hypothetical protein',
+    'DNA gyrase subunit A',
+    'Elongation factor Tu',
+    'ABC transporter ATP-binding protein',
+    'Putative HTH-type transcriptional regulator',
+    '50S ribosomal protein L2',
+]
+
+TRNA_PRODUCTS = ['tRNA-Leu(taa)', 'tRNA-Gly(gcc)', 'tRNA-Met(cat)', 'tRNA-Ser(gga)']
+
+RRNA_PRODUCTS = ['5S ribosomal RNA', '16S ribosomal RNA', '23S ribosomal RNA']
+
+
+def cds_attributes(locus_tag, richness, rng):
+    """
+    This function builds the attributes of a prokka CDS for an attribute
+    richness of 'minimal', 'prokka' or 'rich'.
+    """
+    attributes = [f"ID={locus_tag}", f"Parent={locus_tag}_mRNA"]
+    if richness == 'rich':
+        attributes.append(f"eC_number=3.6.3.{rng.randint(1, 60)}")
+        attributes.append(f"Name=gene{rng.randint(1, 5000)}")
+        attributes.append(f"db_xref=COG:COG{rng.randint(1, 5000):04d}")
+        attributes.append(f"gene=gene{rng.randint(1, 5000)}")
+    if richness == 'rich':
+        attributes.append("inference=ab initio prediction:Prodigal:002006,similar to AA sequence:UniProtKB:P0A6F5")
+    elif richness == 'prokka':
+        attributes.append("inference=ab initio prediction:Prodigal:002006")
+    attributes.append(f"locus_tag={locus_tag}")
+    if richness != 'minimal':
+        attributes.append(f"product={rng.choice(PRODUCTS)}")
+    if richness == 'rich':
+        attributes.append("note=predicted by benchmark generator")
+    return ';'.join(attributes)
+
+
+def generate_prokka_gff(path, n_loci, n_contigs=50, seed=0, trna_fraction=0.02, rrna_fraction=0.005,
+                        crispr_fraction=0.001, richness='prokka', fasta=True, contig_prefix='contig_'):
+    """
+    This function writes a deterministic prokka-like GFF3 file (prokka --compliant layout: gene, mRNA and
+    CDS records; gene, mRNA and tRNA; gene and rRNA; minced CRISPR repeat regions) with ##sequence-region
+    headers and, optionally, the ##FASTA section with the contig sequences.
+
+    Returns: number of feature lines written
+    """
+    rng = random.Random(seed)
+    loci_per_contig = [n_loci // n_contigs + (1 if i < n_loci % n_contigs else 0) for i in range(n_contigs)]
+    contigs = []
+    features = 0
+
+    with open(path, 'w', buffering=1 << 20) as gff:
+        gff.write('##gff-version 3\n')
+        lengths = [loci * 1100 + 1000 for loci in loci_per_contig]
+        for number, length in enumerate(lengths, start=1):
+            contigs.append((f"{contig_prefix}{number}", length))
+            gff.write(f"##sequence-region {contig_prefix}{number} 1 {length}\n")
+
+        locus_number = 0
+        for (contig, length), loci in zip(contigs, loci_per_contig):
+            position = rng.randint(1, 300)
+            for _ in range(loci):
+                locus_number += 1
+                locus_tag = f"BENCH_{locus_number:07d}"
+                roll = rng.random()
+                strand = rng.choice('+-')
+
+                if roll < crispr_fraction:
+                    end = position + rng.randint(100, 600)
+                    gff.write(f"{contig}\tminced:0.4.2\trepeat_region\t{position}\t{end}\t.\t.\t.\t"
+                              f"note=CRISPR with {rng.randint(3, 20)} repeat units;rpt_family=CRISPR;"
+                              f"rpt_type=direct;rpt_unit_seq=GTTTCAATCCACGCGCCCACGCGGGG\n")
+                    features += 1
+
+                elif roll < crispr_fraction + trna_fraction:
+                    end = position + rng.randint(70, 95)
+                    gff.write(f"{contig}\tAragorn:001002\tgene\t{position}\t{end}\t.\t{strand}\t.\t"
+                              f"ID={locus_tag}_gene;locus_tag={locus_tag}\n")
+                    gff.write(f"{contig}\tAragorn:001002\tmRNA\t{position}\t{end}\t.\t{strand}\t.\t"
+                              f"ID={locus_tag}_mRNA;Parent={locus_tag}_gene;locus_tag={locus_tag}\n")
+                    gff.write(f"{contig}\tAragorn:001002\ttRNA\t{position}\t{end}\t.\t{strand}\t.\t"
+                              f"ID={locus_tag};Parent={locus_tag}_mRNA;inference=COORDINATES:profile:Aragorn:001002;"
+                              f"locus_tag={locus_tag};product={rng.choice(TRNA_PRODUCTS)}\n")
+                    features += 3
+
+                elif roll < crispr_fraction + trna_fraction + rrna_fraction:
+                    end = position + rng.choice([110, 1540, 2900])
+                    gff.write(f"{contig}\tbarrnap:0.9\tgene\t{position}\t{end}\t.\t{strand}\t.\t"
+                              f"ID={locus_tag}_gene;locus_tag={locus_tag}\n")
+                    gff.write(f"{contig}\tbarrnap:0.9\trRNA\t{position}\t{end}\t.\t{strand}\t.\t"
+                              f"ID={locus_tag};Parent={locus_tag}_gene;inference=COORDINATES:profile:barrnap:0.9;"
+                              f"locus_tag={locus_tag};product={rng.choice(RRNA_PRODUCTS)}\n")
+                    features += 2
+
+                else:
+                    end = position + 3 * rng.randint(30, 600) - 1
+                    gff.write(f"{contig}\tprokka\tgene\t{position}\t{end}\t.\t{strand}\t.\t"
+                              f"ID={locus_tag}_gene;locus_tag={locus_tag}\n")
+                    gff.write(f"{contig}\tprokka\tmRNA\t{position}\t{end}\t.\t{strand}\t.\t"
+                              f"ID={locus_tag}_mRNA;Parent={locus_tag}_gene;locus_tag={locus_tag}\n")
+                    gff.write(f"{contig}\tProdigal:002006\tCDS\t{position}\t{end}\t.\t{strand}\t0\t"
+                              f"{cds_attributes(locus_tag, richness, rng)}\n")
+                    features += 3
+
+                # Prokka features may overlap their neighbours by a few bases
+                position = max(position + 1, end + rng.randint(-20, 200))
+
+        if fasta:
+            gff.write('##FASTA\n')
+            for contig, length in contigs:
+                gff.write(f">{contig}\n")
+                line = ''.join(rng.choice('ACGT') for _ in range(60)) + '\n'
+                gff.write(line * (length // 60))
+                if length % 60:
+                    gff.write(line[:length % 60] + '\n')
+
+    return features
+
+
+def git_commit():
+    """
+    This function returns the current git commit of prokka2vep, if any.
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(PROKKA2VEP),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_conversion(input_gff, output_gff, engine, extra_args=()):
+    """
+    This function runs prokka2vep in a fresh process with --profile, so that the peak memory of every run
+    is measured on its own.
+
+    Returns: the end-to-end wall time and the stage report of the run
+    """
+    profile = output_gff + '.profile.json'
+    command = [sys.executable, PROKKA2VEP, '--gff', input_gff, '--out', output_gff, '--engine', engine,
+               '--profile', profile, *extra_args]
+    started = time.perf_counter()
+    subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+    wall = time.perf_counter() - started
+    with open(profile, 'r') as profile_f:
+        report = json.load(profile_f)
+    os.remove(profile)
+    return wall, report
+
+
+def run_benchmark(sizes, engines, workdir, repeat=3, extra_args=(), **generator_options):
+    """
+    This function generates an input for every size (reused when it already exists in workdir) and converts
+    it with every engine, keeping the fastest of the repeated runs.
+
+    Returns: list of benchmark results
+    """
+    os.makedirs(workdir, exist_ok=True)
+    results = []
+    for size in sizes:
+        options = hashlib.sha1(json.dumps(generator_options, sort_keys=True).encode()).hexdigest()[:8]
+        input_gff = os.path.join(workdir, f"bench_{size}_{options}.gff")
+        if not os.path.exists(input_gff):
+            print(f"Generating {input_gff} ...")
+            generate_prokka_gff(input_gff, size, **generator_options)
+
+        for engine in engines:
+            output_gff = os.path.join(workdir, f"bench_{size}_{engine}_vep.gff")
+            best = None
+            for _ in range(repeat):
+                wall, report = run_conversion(input_gff, output_gff, engine, extra_args)
+                if best is None or wall < best[0]:
+                    best = (wall, report)
+            for name in os.listdir(workdir):
+                if name.startswith(os.path.basename(output_gff)):
+                    os.remove(os.path.join(workdir, name))
+
+            wall, report = best
+            results.append({
+                'loci': size,
+                'engine': engine,
+                'input_bytes': os.path.getsize(input_gff),
+                'wall_seconds': round(wall, 6),
+                'peak_rss_scope': report['peak_rss_scope'],
+                'stages': report['stages']
+            })
+            print(f"{size:>10} loci  {engine:<8} {wall:10.3f} s")
+    return results
+
+
+def stage_totals(result):
+    """
+    This function sums the wall time of the stages of a result by stage name (a stage can run twice).
+    """
+    totals = {}
+    for stage in result['stages']:
+        totals[stage['stage']] = totals.get(stage['stage'], 0.0) + stage['wall_seconds']
+    return totals
+
+
+def compare_results(baseline, current):
+    """
+    This function prints the speedup of the current results over a baseline, end-to-end and per stage.
+    """
+    baseline_runs = {(result['loci'], result['engine']): result for result in baseline['results']}
+    print(f"{'loci':>10}  {'engine':<8} {'stage':<24} {'baseline s':>11} {'current s':>11} {'speedup':>8}")
+    for result in current['results']:
+        previous = baseline_runs.get((result['loci'], result['engine']))
+        if previous is None:
+            continue
+        rows = [('end-to-end', previous['wall_seconds'], result['wall_seconds'])]
+        previous_stages = stage_totals(previous)
+        for stage, seconds in stage_totals(result).items():
+            if stage in previous_stages:
+                rows.append((stage, previous_stages[stage], seconds))
+        for stage, before, after in rows:
+            speedup = before / after if after else float('inf')
+            print(f"{result['loci']:>10}  {result['engine']:<8} {stage:<24} {before:11.3f} {after:11.3f} "
+                  f"{speedup:7.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark prokka2vep on synthetic prokka GFF files')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    generator_args = argparse.ArgumentParser(add_help=False)
+    generator_args.add_argument('--contigs', type=int, default=50, help='Number of contigs (default: 50)')
+    generator_args.add_argument('--seed', type=int, default=0, help='Random seed (default: 0)')
+    generator_args.add_argument('--trna', type=float, default=0.02, help='Fraction of tRNA loci (default: 0.02)')
+    generator_args.add_argument('--rrna', type=float, default=0.005, help='Fraction of rRNA loci (default: 0.005)')
+    generator_args.add_argument('--crispr', type=float, default=0.001,
+                                help='Fraction of CRISPR repeat regions (default: 0.001)')
+    generator_args.add_argument('--richness', choices=['minimal', 'prokka', 'rich'], default='prokka',
+                                help='Attributes of the CDS records (default: prokka)')
+    generator_args.add_argument('--no-fasta', action='store_true', help='Do not write the ##FASTA section')
+
+    generate_parser = subparsers.add_parser('generate', parents=[generator_args],
+                                            help='Write a synthetic prokka GFF file')
+    generate_parser.add_argument('--loci', type=int, required=True, help='Number of loci')
+    generate_parser.add_argument('--out', required=True, help='Output GFF file path')
+
+    run_parser = subparsers.add_parser('run', parents=[generator_args], help='Run the benchmark')
+    run_parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                            help='Number of loci of the inputs, up to 10M (default: 1000 10000 100000)')
+    run_parser.add_argument('--engines', nargs='+', choices=['stream', 'pandas'], default=['stream', 'pandas'],
+                            help='Engines to benchmark (default: stream pandas)')
+    run_parser.add_argument('--repeat', type=int, default=3, help='Runs per input, the fastest is kept (default: 3)')
+    run_parser.add_argument('--workdir', default='benchmark_data', help='Directory of the generated inputs')
+    run_parser.add_argument('--output', default='benchmark_results.json', help='Results file (JSON)')
+    run_parser.add_argument('--compare', help='Previous results file to compare with')
+    run_parser.add_argument('--prokka2vep-args', default='',
+                            help='Extra prokka2vep options of every run, e.g. --prokka2vep-args="--bgzip"')
+
+    compare_parser = subparsers.add_parser('compare', help='Compare two results files')
+    compare_parser.add_argument('baseline', help='Baseline results file')
+    compare_parser.add_argument('current', help='Current results file')
+
+    args = parser.parse_args()
+
+    if args.command == 'compare':
+        with open(args.baseline, 'r') as baseline_f, open(args.current, 'r') as current_f:
+            compare_results(json.load(baseline_f), json.load(current_f))
+        return
+
+    generator_options = {
+        'n_contigs': args.contigs,
+        'seed': args.seed,
+        'trna_fraction': args.trna,
+        'rrna_fraction': args.rrna,
+        'crispr_fraction': args.crispr,
+        'richness': args.richness,
+        'fasta': not args.no_fasta
+    }
+
+    if args.command == 'generate':
+        features = generate_prokka_gff(args.out, args.loci, **generator_options)
+        print(f"{features} features written to {args.out}")
+        return
+
+    results = run_benchmark(args.sizes, args.engines, args.workdir, args.repeat,
+                            args.prokka2vep_args.split(), **generator_options)
+    current = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'generator': generator_options,
+        'results': results
+    }
+    with open(args.output, 'w') as output_f:
+        json.dump(current, output_f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r') as baseline_f:
+            compare_results(json.load(baseline_f), current)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,270 +7,2771 @@ Description: This Python script convert the GFF3 file of prokka to fit it to the
 """
 
 import argparse
-import pandas as pd
-import csv
+import collections
+import concurrent.futures
+import contextlib
+import functools
+import glob
+import gzip
+import hashlib
+import io
+import itertools
+import json
+import mmap
 import os
+import pickle
+import re
+import shutil
+import stat
+import struct
+import sys
+import tempfile
+import time
+import zlib
 
-def process_gff_file(input_file, output_file):
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+__version__ = '0.2.0'
+
+# Order of the VEP records sharing the same coordinates; any other feature
+# type (tRNA, rRNA, repeat_region, ...) comes after them.
+FEATURE_RANK = {'gene': 0, 'transcript': 1, 'exon': 2, 'CDS': 3}
+
+# Conversion of the prokka records into VEP records, compiled once by
+# ConversionPlan. Every rule takes the records of one prokka feature type,
+# whose ID is '<locus><id_suffix>', and emits one record per template: the
+# first one is the prokka record itself, the others are copies. The templates
+# set the feature type and attributes ('{locus}' is replaced by the locus; a
+# template without ID keeps the prokka ID). The locus_rewrites of a rule
+# change the other VEP records of the same locus, by type: None drops them.
+CONVERSION_RULES = [
+    {'type': 'gene', 'id_suffix': '_gene', 'emit': [
+        {'type': 'gene'},
+        {'type': 'transcript', 'ID': '{locus}_transcript', 'Parent': '{locus}_gene', 'biotype': 'protein_coding'},
+    ]},
+    {'type': 'mRNA', 'id_suffix': '_mRNA', 'emit': [
+        {'type': 'exon', 'Parent': '{locus}_transcript', 'ID': '{locus}_exon'},
+    ]},
+    {'type': 'CDS', 'emit': [
+        {'type': 'CDS', 'Parent': '{locus}_transcript', 'ID': '{locus}_cds'},
+    ]},
+    # The non-coding RNA loci keep their gene and exon but lose the transcript
+    {'type': 'tRNA', 'emit': [
+        {'type': 'tRNA', 'biotype': 'tRNA', 'Parent': '{locus}_gene'},
+    ], 'locus_rewrites': {'transcript': None, 'exon': {'Parent': '{locus}_gene'}}},
+    {'type': 'rRNA', 'emit': [
+        {'type': 'rRNA', 'biotype': 'rRNA', 'Parent': '{locus}_gene'},
+    ], 'locus_rewrites': {'transcript': None, 'exon': {'Parent': '{locus}_gene'}}},
+]
+
+GFF_EXTENSIONS = ('.gff', '.gff3')
+COMPRESSED_EXTENSIONS = ('.gz', '.bgz', '.zst')
+
+GZIP_MAGIC = b'\x1f\x8b'
+BGZF_MAGIC = b'\x1f\x8b\x08\x04'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+# Bytes of an uncompressed gff decoded at once by scan_gff_mmap
+SCAN_CHUNK_SIZE = 1 << 20
+
+# Rows joined at once and buffer size of the gff writer of the pandas engine
+WRITE_CHUNK_ROWS = 65536
+WRITE_BUFFER_SIZE = 1 << 20
+
+DECOMPRESSION_THREADS = min(4, os.cpu_count() or 1)
+
+# Records of the contigs written out of turn by the streaming engine that are
+# kept in memory before they are spilled to a temporary file
+PENDING_ROWS = 65536
+
+MANIFEST_SUFFIX = '.p2v.json'
+
+# Columnar output: file extension of every format, and the columns that are
+# dictionary encoded because they repeat a few values
+COLUMNAR_FORMATS = {'parquet': '.parquet', 'arrow': '.arrow'}
+DICTIONARY_COLUMNS = ('SeqName', 'Source', 'FeatureType', 'Strand')
+
+CACHE_SIZE_UNITS = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+
+# Strand and phase values of a GffFeature, packed as two 2-bit codes
+STRANDS = ('+', '-', '.', '?')
+PHASES = ('0', '1', '2', '.')
+STRAND_PHASE_FLAGS = {strand + phase: strand_code | phase_code << 2
+                      for strand_code, strand in enumerate(STRANDS) for phase_code, phase in enumerate(PHASES)}
+
+GFF_COLUMNS = [
+    'SeqName',
+    'Source',
+    'FeatureType',
+    'Start',
+    'End',
+    'Score',
+    'Strand',
+    'Phase',
+    'Attributes'
+]
+
+pd = None  # pandas and numpy are only imported by the dataframe functions, see import_pandas
+np = None
+
+
+def import_pandas():
+    """
+    This function imports pandas (and numpy) the first time a dataframe is
+    needed, so that the streaming engine starts without paying for the
+    pandas import.
+    """
+    global pd, np
+    if pd is None:
+        import numpy
+        import pandas
+        np = numpy
+        pd = pandas
+    return pd
+
+
+def import_pyarrow():
+    """
+    This function imports pyarrow, which is only needed for the Parquet and
+    Arrow outputs.
+    """
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("pyarrow is required for the Parquet/Arrow output (pip install pyarrow)") from None
+    return pyarrow
+
+
+def inflate_bgzf_block(cdata, crc, isize):
+    """
+    This function decompresses the deflate payload of one BGZF block and
+    checks it against the CRC32 and size stored in the block footer.
+    """
+    data = zlib.decompress(cdata, -15)
+    if len(data) != isize or zlib.crc32(data) != crc:
+        raise OSError('Corrupted BGZF block')
+    return data
+
+
+class BgzfReader(io.RawIOBase):
+    """
+    This class decompresses an open BGZF (bgzip) file. The BGZF blocks are
+    independent deflate streams, so the next blocks are inflated in a thread
+    pool (zlib releases the GIL) while the current one is being parsed.
+    """
+
+    def __init__(self, input_f, threads=DECOMPRESSION_THREADS):
+        super().__init__()
+        self._file = input_f
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+        self._queue = collections.deque()
+        self._max_queued = threads * 4
+        self._data = b''
+        self._offset = 0
+        self._eof = False
+
+    def readable(self):
+        return True
+
+    def _read_block(self):
+        header = self._file.read(12)
+        if not header:
+            return None
+        if len(header) < 12 or header[:4] != BGZF_MAGIC:
+            raise OSError(f'Not a BGZF block in {self._file.name}')
+        xlen = struct.unpack('<H', header[10:12])[0]
+        extra = self._file.read(xlen)
+
+        # The block size is stored in the 'BC' subfield of the extra field
+        block_size = None
+        position = 0
+        while position + 4 <= len(extra):
+            subfield_length = struct.unpack('<H', extra[position + 2:position + 4])[0]
+            if extra[position:position + 2] == b'BC':
+                block_size = struct.unpack('<H', extra[position + 4:position + 6])[0] + 1
+            position += 4 + subfield_length
+        if block_size is None:
+            raise OSError(f'Missing BGZF block size in {self._file.name}')
+
+        payload = self._file.read(block_size - 12 - xlen)
+        crc, isize = struct.unpack('<II', payload[-8:])
+        return payload[:-8], crc, isize
+
+    def _fill_queue(self):
+        while not self._eof and len(self._queue) < self._max_queued:
+            block = self._read_block()
+            if block is None:
+                self._eof = True
+            else:
+                self._queue.append(self._executor.submit(inflate_bgzf_block, *block))
+
+    def readinto(self, buffer):
+        while self._offset >= len(self._data):
+            self._fill_queue()
+            if not self._queue:
+                return 0
+            self._data = self._queue.popleft().result()
+            self._offset = 0
+
+        size = min(len(buffer), len(self._data) - self._offset)
+        buffer[:size] = self._data[self._offset:self._offset + size]
+        self._offset += size
+        return size
+
+    def close(self):
+        if not self.closed:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._file.close()
+        super().close()
+
+
+BGZF_BLOCK_SIZE = 0xff00
+BGZF_EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+# Tabix binning scheme: 16 kb windows, 6 levels of bins
+INDEX_MIN_SHIFT = 14
+INDEX_DEPTH = 5
+INDEX_META_BIN = ((1 << (3 * (INDEX_DEPTH + 1))) - 1) // 7 + 1
+
+
+class BgzfWriter:
+    """
+    This class writes a BGZF (bgzip) file: deflate blocks of at most 64 kb that
+    tools like tabix and VEP can seek into with virtual offsets (the block
+    position in the file shifted by 16 bits, plus the position in the block).
+    """
+
+    def __init__(self, path, level=6):
+        self._file = open(path, 'wb')
+        self._level = level
+        self._buffer = bytearray()
+        self._block_offset = 0
+        self._uncompressed_offset = 0
+        # (compressed, uncompressed) offsets of the blocks, for a .gzi index
+        self.block_offsets = []
+
+    def tell(self):
+        return (self._block_offset << 16) | len(self._buffer)
+
+    def uncompressed_tell(self):
+        return self._uncompressed_offset + len(self._buffer)
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= BGZF_BLOCK_SIZE:
+            self._write_block(bytes(self._buffer[:BGZF_BLOCK_SIZE]))
+            del self._buffer[:BGZF_BLOCK_SIZE]
+
+    def flush(self):
+        """
+        This method compresses the buffered data into a block, so that the
+        next write starts at the beginning of a new block.
+        """
+        if self._buffer:
+            self._write_block(bytes(self._buffer))
+            self._buffer.clear()
+
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.write(BGZF_EOF)
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _write_block(self, data):
+        compressor = zlib.compressobj(self._level, zlib.DEFLATED, -15)
+        cdata = compressor.compress(data) + compressor.flush()
+        if len(cdata) > 0x10000 - 26:
+            # Incompressible data, store it instead
+            compressor = zlib.compressobj(0, zlib.DEFLATED, -15)
+            cdata = compressor.compress(data) + compressor.flush()
+        header = BGZF_MAGIC + struct.pack('<IBBHBBHH', 0, 0, 0xff, 6, ord('B'), ord('C'), 2, len(cdata) + 25)
+        block = header + cdata + struct.pack('<II', zlib.crc32(data), len(data))
+        self.block_offsets.append((self._block_offset, self._uncompressed_offset))
+        self._file.write(block)
+        self._block_offset += len(block)
+        self._uncompressed_offset += len(data)
+
+    def copy_blocks(self, data, uncompressed_size):
+        """
+        This method appends complete BGZF blocks (e.g. copied from another
+        BGZF file) holding uncompressed_size bytes of data.
+        """
+        self.flush()
+        self._file.write(data)
+        self._block_offset += len(data)
+        self._uncompressed_offset += uncompressed_size
+
+    def write_gzi(self, path):
+        """
+        This method writes the .gzi index of the blocks (as bgzip -i), which
+        samtools faidx needs to read a compressed fasta.
+        """
+        with open(path, 'wb') as gzi_f:
+            offsets = self.block_offsets[1:]  # The first block at 0/0 is implicit
+            gzi_f.write(struct.pack('<Q', len(offsets)))
+            for compressed_offset, uncompressed_offset in offsets:
+                gzi_f.write(struct.pack('<QQ', compressed_offset, uncompressed_offset))
+
+
+class BgzfFastaWriter:
+    """
+    This class writes the sequences of the ##FASTA section of a prokka gff3
+    file as a BGZF compressed fasta with its samtools faidx indexes (.fai and
+    .gzi). The sequences are re-wrapped to a fixed line width, as the .fai
+    index requires.
+    """
+
+    def __init__(self, path, line_width=60):
+        self.path = path
+        self.line_width = line_width
+        self._bgzf = BgzfWriter(path)
+        self._fai = []
+        self._name = None
+        self._offset = 0
+        self._length = 0
+        self._carry = b''
+
+    def start_sequence(self, header):
+        """
+        This method starts a new sequence from its '>' header line.
+        """
+        self._end_sequence()
+        if isinstance(header, (bytes, bytearray, memoryview)):
+            header = bytes(header).decode()
+        header = header.strip()
+        self._name = header[1:].split()[0] if len(header) > 1 else ''
+        self._bgzf.write(header.encode() + b'\n')
+        self._offset = self._bgzf.uncompressed_tell()
+        self._length = 0
+
+    def add_sequence(self, sequence):
+        """
+        This method appends bases (bytes, without newlines) to the current sequence.
+        """
+        if self._name is None or not sequence:
+            return
+        self._length += len(sequence)
+        data = self._carry + sequence
+        width = self.line_width
+        full = len(data) - len(data) % width
+        if full:
+            self._bgzf.write(b''.join(data[start:start + width] + b'\n' for start in range(0, full, width)))
+        self._carry = data[full:]
+
+    def _end_sequence(self):
+        if self._name is None:
+            return
+        if self._carry:
+            self._bgzf.write(self._carry + b'\n')
+            self._carry = b''
+        line_bases = min(self._length, self.line_width)
+        self._fai.append(f"{self._name}\t{self._length}\t{self._offset}\t{line_bases}\t{line_bases + 1}\n")
+        self._name = None
+
+    def close(self):
+        self._end_sequence()
+        self._bgzf.close()
+        self._bgzf.write_gzi(self.path + '.gzi')
+        with open(self.path + '.fai', 'w') as fai_f:
+            fai_f.writelines(self._fai)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def write_fasta_section(data, fasta_writer, position=0):
+    """
+    This function writes the fasta section of an mmap (or any bytes-like
+    object), starting at the '>' header at position, to a BgzfFastaWriter,
+    one sequence at a time.
+    """
+    end = len(data)
+    while position < end:
+        header_end = data.find(b'\n', position)
+        if header_end == -1:
+            header_end = end
+        next_header = data.find(b'\n>', header_end)
+        next_header = end if next_header == -1 else next_header + 1
+        fasta_writer.start_sequence(data[position:header_end])
+        sequence = data[header_end + 1:next_header]
+        fasta_writer.add_sequence(bytes(sequence).translate(None, b' \t\r\n'))
+        position = next_header
+
+
+def region_to_bin(start, end):
+    """
+    This function returns the smallest tabix bin containing the 0-based,
+    half-open interval [start, end).
+    """
+    end -= 1
+    for level in range(INDEX_DEPTH, 0, -1):
+        shift = INDEX_MIN_SHIFT + 3 * (INDEX_DEPTH - level)
+        if start >> shift == end >> shift:
+            return ((1 << (3 * level)) - 1) // 7 + (start >> shift)
+    return 0
+
+
+def bin_first_window(bin_number):
+    """
+    This function returns the first 16 kb window covered by a tabix bin.
+    """
+    level = 0
+    parent = bin_number
+    while parent:
+        parent = (parent - 1) >> 3
+        level += 1
+    first_bin = ((1 << (3 * level)) - 1) // 7
+    return (bin_number - first_bin) << (3 * (INDEX_DEPTH - level))
+
+
+class TabixIndexer:
+    """
+    This class builds a tabix index (.tbi, or .csi) of a coordinate sorted gff
+    file while it is being written, from the virtual offsets of its records.
+    """
+
+    def __init__(self):
+        self.contigs = []
+        self._contig_index = {}
+        self._bins = None
+        self._linear = None
+        self._meta = None
+
+    def add(self, seqname, start, end, first_offset, last_offset):
+        """
+        This method adds a record with 1-based inclusive gff coordinates that
+        was written between the virtual offsets first_offset and last_offset.
+        """
+        if seqname != (self.contigs[-1][0] if self.contigs else None):
+            if seqname in self._contig_index:
+                raise ValueError(f"The records of {seqname} are not grouped together, cannot index the output")
+            self._contig_index[seqname] = len(self.contigs)
+            self._bins = {}
+            self._linear = []
+            self._meta = [first_offset, last_offset, 0]
+            self.contigs.append((seqname, self._bins, self._linear, self._meta))
+
+        start -= 1
+        end = max(end, start + 1)
+        chunks = self._bins.setdefault(region_to_bin(start, end), [])
+        if chunks and chunks[-1][1] == first_offset:
+            chunks[-1][1] = last_offset
+        else:
+            chunks.append([first_offset, last_offset])
+
+        last_window = (end - 1) >> INDEX_MIN_SHIFT
+        if len(self._linear) <= last_window:
+            self._linear.extend([None] * (last_window + 1 - len(self._linear)))
+        for window in range(start >> INDEX_MIN_SHIFT, last_window + 1):
+            if self._linear[window] is None:
+                self._linear[window] = first_offset
+
+        self._meta[1] = last_offset
+        self._meta[2] += 1
+
+    def contig_entries(self, seqname):
+        """
+        Returns: the (bins, linear index, meta) entries of a contig, or None
+        """
+        position = self._contig_index.get(seqname)
+        return None if position is None else self.contigs[position][1:]
+
+    def add_contig(self, seqname, bins, linear, meta, shift=0):
+        """
+        This method adds the index entries of a whole contig (as in
+        self.contigs) whose records were moved by shift bytes of compressed
+        data, e.g. copied from a previous output.
+        """
+        if seqname in self._contig_index:
+            raise ValueError(f"The records of {seqname} are not grouped together, cannot index the output")
+        shift <<= 16
+        bins = {int(bin_number): [[first + shift, last + shift] for first, last in chunks]
+                for bin_number, chunks in bins.items()}
+        linear = [offset + shift if offset is not None else None for offset in linear]
+        meta = [meta[0] + shift, meta[1] + shift, meta[2]]
+        self._contig_index[seqname] = len(self.contigs)
+        self.contigs.append((seqname, bins, linear, meta))
+
+    def _filled_linear(self, linear, meta):
+        filled = []
+        previous = meta[0]
+        for offset in linear:
+            previous = offset if offset is not None else previous
+            filled.append(previous)
+        return filled
+
+    def _header(self):
+        names = b''.join(name.encode() + b'\0' for name, *_ in self.contigs)
+        # Generic format, sequence/start/end in columns 1/4/5, '#' comments
+        return struct.pack('<6i', 0, 1, 4, 5, ord('#'), 0) + struct.pack('<i', len(names)) + names
+
+    def write_tbi(self, path):
+        data = bytearray(b'TBI\1')
+        data += struct.pack('<i', len(self.contigs))
+        data += self._header()
+        for _, bins, linear, meta in self.contigs:
+            data += struct.pack('<i', len(bins) + 1)
+            for bin_number, chunks in bins.items():
+                data += struct.pack('<Ii', bin_number, len(chunks))
+                for chunk in chunks:
+                    data += struct.pack('<QQ', *chunk)
+            data += struct.pack('<IiQQQQ', INDEX_META_BIN, 2, meta[0], meta[1], meta[2], 0)
+            filled = self._filled_linear(linear, meta)
+            data += struct.pack('<i', len(filled))
+            data += struct.pack(f'<{len(filled)}Q', *filled)
+        data += struct.pack('<Q', 0)
+        with BgzfWriter(path) as index_f:
+            index_f.write(data)
+
+    def write_csi(self, path):
+        header = self._header()
+        data = bytearray(b'CSI\1')
+        data += struct.pack('<iii', INDEX_MIN_SHIFT, INDEX_DEPTH, len(header)) + header
+        data += struct.pack('<i', len(self.contigs))
+        for _, bins, linear, meta in self.contigs:
+            filled = self._filled_linear(linear, meta)
+            data += struct.pack('<i', len(bins) + 1)
+            for bin_number, chunks in bins.items():
+                window = bin_first_window(bin_number)
+                bin_offset = filled[window] if window < len(filled) else 0
+                data += struct.pack('<IQi', bin_number, bin_offset, len(chunks))
+                for chunk in chunks:
+                    data += struct.pack('<QQ', *chunk)
+            data += struct.pack('<IQiQQQQ', INDEX_META_BIN, 0, 2, meta[0], meta[1], meta[2], 0)
+        data += struct.pack('<Q', 0)
+        with BgzfWriter(path) as index_f:
+            index_f.write(data)
+
+
+class BgzfGffWriter:
+    """
+    This class writes the converted gff lines as a BGZF file and builds its
+    tabix (.tbi) or .csi index in the same pass, ready for VEP's --gff option.
+    """
+
+    def __init__(self, path, index='tbi'):
+        self.path = path
+        self.index = index
+        self._bgzf = BgzfWriter(path)
+        self._indexer = TabixIndexer() if index else None
+
+    def write(self, line):
+        first_offset = self._bgzf.tell()
+        self._bgzf.write(line.encode())
+        if self._indexer is not None and not line.startswith('#'):
+            fields = line.split('\t', 5)
+            self._indexer.add(fields[0], int(fields[3]), int(fields[4]), first_offset, self._bgzf.tell())
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def start_block(self):
+        """
+        This method starts a new BGZF block, e.g. at a contig boundary.
+
+        Returns: the offset of the new block in the compressed file
+        """
+        self._bgzf.flush()
+        return self._bgzf.tell() >> 16
+
+    def copy_contig(self, seqname, data, length, index_entry=None, shift=0):
+        """
+        This method appends the BGZF blocks of a whole contig (length bytes
+        once decompressed) with its index entries, see TabixIndexer.add_contig.
+        """
+        self._bgzf.copy_blocks(data, length)
+        if self._indexer is not None and index_entry is not None:
+            self._indexer.add_contig(seqname, *index_entry, shift)
+
+    def contig_index(self, seqname):
+        """
+        Returns: the (bins, linear index, meta) index entries of a contig, or
+        None if it is not indexed
+        """
+        if self._indexer is None:
+            return None
+        return self._indexer.contig_entries(seqname)
+
+    def close(self):
+        self._bgzf.close()
+        if self.index == 'tbi':
+            self._indexer.write_tbi(self.path + '.tbi')
+        elif self.index == 'csi':
+            self._indexer.write_csi(self.path + '.csi')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.close()
+        else:
+            self._bgzf.close()
+
+
+def open_gff_output(output_file, bgzip=False, index='tbi'):
+    """
+    This function opens the converted gff for writing, as plain text or as
+    BGZF with a tabix/csi index (index=None to skip the index).
+    """
+    if bgzip:
+        return BgzfGffWriter(output_file, index)
+    return open(output_file, 'w')
+
+
+def compression_format(magic):
+    """
+    This function tells the compression of a file from its first bytes.
+
+    Returns: 'bgzf', 'gzip', 'zstd' or None for an uncompressed file
+    """
+    if magic.startswith(BGZF_MAGIC) and magic[12:14] == b'BC':
+        return 'bgzf'
+    if magic.startswith(GZIP_MAGIC):
+        return 'gzip'
+    if magic.startswith(ZSTD_MAGIC):
+        return 'zstd'
+    return None
+
+
+def is_regular_file(input_file):
+    """
+    This function tells if a path is a regular file, which can be read more
+    than once, unlike a pipe (e.g. <(zcat ...)) or another stream.
+    """
+    try:
+        return stat.S_ISREG(os.stat(input_file).st_mode)
+    except OSError:
+        return False
+
+
+def is_mappable(input_file):
+    """
+    This function tells if a gff file can be read through mmap (and in byte
+    ranges, see split_feature_section): a non-empty uncompressed regular file.
+    Pipes and other streams can only be read once, so they are not probed.
+    """
+    if not is_regular_file(input_file) or os.path.getsize(input_file) == 0:
+        return False
+    with open(input_file, 'rb') as probe:
+        return compression_format(probe.read(14)) is None
+
+
+@contextlib.contextmanager
+def open_gff(input_file, threads=DECOMPRESSION_THREADS):
+    """
+    This function opens a gff file for reading as text. Gzip, BGZF and zstd
+    compressed files are detected from their magic bytes and decompressed on
+    the fly; BGZF (and gzip, when python-isal is installed) is decompressed
+    with several threads. The file is opened once and the magic bytes are
+    peeked at in its buffer, so pipes (e.g. <(zcat ...)) are read whole.
+    """
+    with open(input_file, 'rb') as input_f:
+        compression = compression_format(input_f.peek(14)[:14])
+
+        if compression == 'bgzf':
+            text_f = io.TextIOWrapper(io.BufferedReader(BgzfReader(input_f, threads), buffer_size=1 << 16))
+
+        # The optional decompression packages are only imported when needed
+        elif compression == 'gzip':
+            text_f = None
+            if threads > 1:
+                try:
+                    from isal import igzip_threaded
+                except ImportError:
+                    pass
+                else:
+                    text_f = igzip_threaded.open(input_f, 'rt', threads=threads)
+            if text_f is None:
+                text_f = gzip.open(input_f, 'rt')
+
+        elif compression == 'zstd':
+            try:
+                from compression import zstd
+            except ImportError:
+                try:
+                    import zstandard as zstd
+                except ImportError:
+                    raise ImportError(f'{input_file} is zstd compressed, '
+                                      'please install the zstandard package') from None
+            text_f = zstd.open(input_f, 'rt')
+
+        else:
+            text_f = io.TextIOWrapper(input_f)
+
+        with text_f:
+            yield text_f
+
+
+def process_gff_file(input_file, fasta_writer=None, sequence_regions=None):
     """
     This function takes the gff3 file that comes from prokka
     annotation and remove the gff headers and the fasta sequences 
-    at the end of the file.
+    at the end of the file. With a BgzfFastaWriter, the fasta sequences
+    are written to it once the feature lines have been consumed. With a
+    sequence_regions list, the contig names of the ##sequence-region headers
+    are appended to it as they are read.
 
     Returns:
-        a temp 9-column temp file wihtout headers nor fasta sequences 
+        a generator of the 9-column lines (strings) wihtout headers nor fasta
+        sequences; uncompressed files are scanned through mmap (see scan_gff_mmap)
     """
-    in_fasta_section = False
+    if is_mappable(input_file):
+        yield from scan_gff_mmap(input_file, fasta_writer, sequence_regions)
+        return
 
-    with open(input_file, 'r') as input_f, open(output_file, 'w') as output_f:
+    with open_gff(input_file) as input_f:
         for line in input_f:
             line = line.strip()
 
             if line.startswith('>'):
-                in_fasta_section = True
-                continue
+                # Everything after the first sequence header is fasta
+                if fasta_writer is not None:
+                    fasta_writer.start_sequence(line)
+                    for line in input_f:
+                        if line.startswith('>'):
+                            fasta_writer.start_sequence(line)
+                        else:
+                            fasta_writer.add_sequence(line.strip().encode())
+                break
 
-            if not in_fasta_section and not line.startswith('#'):
-                output_f.write(line + '\n')
+            if line and not line.startswith('#'):
+                yield line
+            elif sequence_regions is not None and line.startswith('##sequence-region'):
+                sequence_regions.append(line.split()[1])
 
 
-def read_gff_as_dataframe(gff_file):
+def fasta_offset(data):
     """
-    This function reads the temp gff file and returns pandas dataframe
+    This function finds the offset of the first fasta header ('>' at the
+    start of a line) in a bytes-like object such as an mmap.
+
+    Returns: offset of the fasta section, or the data length if there is none
     """
-    print("Reading GFF file as pandas dataframe ...\n")
-    gff_data = []
+    if data[:1] == b'>':
+        return 0
+    position = data.find(b'\n>')
+    return len(data) if position == -1 else position + 1
 
-    with open(gff_file, 'r') as file:
-        for line in file:
-            line = line.strip()
-            if not line:
-                continue  # Skip empty lines
-            fields = line.split('\t')
 
-            # Ensure there are at least 9 fields (standard GFF format)
-            if len(fields) < 9:
-                continue
+def scan_gff_mmap(input_file, fasta_writer=None, sequence_regions=None):
+    """
+    This function scans an uncompressed gff3 file through mmap: the fasta
+    boundary is found with a byte-level search and the feature section is
+    decoded straight from the mapped file in chunks of SCAN_CHUNK_SIZE bytes
+    that end at a line end (through memoryview slices, which never leave this
+    function), skipping the comment and empty lines. The fasta section is then
+    passed to fasta_writer, if any, and the ##sequence-region headers are
+    collected as in process_gff_file.
+
+    Returns: a generator of the feature lines as strings
+    """
+    with open(input_file, 'rb') as input_f, mmap.mmap(input_f.fileno(), 0, access=mmap.ACCESS_READ) as data, \
+            memoryview(data) as view:
+        end = fasta_offset(data)
+        position = 0
+        while position < end:
+            chunk_end = data.find(b'\n', min(position + SCAN_CHUNK_SIZE, end), end)
+            chunk_end = end if chunk_end == -1 else chunk_end + 1
+            with view[position:chunk_end] as chunk:
+                text = str(chunk, 'utf-8')
+            position = chunk_end
+
+            for line in text.split('\n'):
+                if line and line[0] != '#':
+                    yield line
+                elif sequence_regions is not None and line.startswith('##sequence-region'):
+                    sequence_regions.append(line.split()[1])
+
+        if fasta_writer is not None:
+            write_fasta_section(data, fasta_writer, end)
+
+
+def extract_fasta(input_file, fasta_writer):
+    """
+    This function writes the fasta section of a prokka gff3 file to a
+    BgzfFastaWriter without parsing the feature lines, when they are read
+    by other means (see read_gff_as_dataframe_parallel).
+    """
+    if not is_mappable(input_file):
+        for _ in process_gff_file(input_file, fasta_writer):
+            pass
+        return
+
+    with open(input_file, 'rb') as input_f, mmap.mmap(input_f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        write_fasta_section(data, fasta_writer, fasta_offset(data))
+
+
+class Attributes:
+    """
+    This class holds the 9th GFF column (key=value pairs separated by
+    semicolons) as its raw text. The values are looked up in the text only
+    when they are needed and the changed keys are kept apart, so a feature
+    costs a single string instead of a dictionary of strings.
+    """
+
+    __slots__ = ('raw', 'edits')
+
+    def __init__(self, raw, edits=None):
+        self.raw = raw
+        self.edits = edits
+
+    def _find(self, key):
+        if self.raw.startswith(key + '='):
+            start = len(key) + 1
+        else:
+            start = self.raw.find(';' + key + '=')
+            if start == -1:
+                return None
+            start += len(key) + 2
+        end = self.raw.find(';', start)
+        return self.raw[start:] if end == -1 else self.raw[start:end]
 
-            if fields[0].startswith('#'):
-                continue  # Skip comment lines
-
-            seqname = fields[0]
-            source = fields[1]
-            feature_type = fields[2]
-            start = int(fields[3])
-            end = int(fields[4])
-            score = fields[5]
-            strand = fields[6]
-            phase = fields[7]
-            attributes = fields[8]
-
-            # Parse attributes as a dictionary
-            attribute_dict = {}
-            for attr in attributes.split(';'):
-                key, value = attr.split('=')
-                attribute_dict[key] = value
-
-            feature_data = [
-                seqname,
-                source,
-                feature_type,
-                start,
-                end,
-                score,
-                strand,
-                phase,
-                attribute_dict
-            ]
-
-            gff_data.append(feature_data)
-
-    columns = [
-        'SeqName',
-        'Source',
-        'FeatureType',
-        'Start',
-        'End',
-        'Score',
-        'Strand',
-        'Phase',
-        'Attributes'
+    def get(self, key, default=None):
+        if self.edits and key in self.edits:
+            return self.edits[key]
+        value = self._find(key)
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        if self.edits is None:
+            self.edits = {}
+        self.edits[key] = value
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def replace(self, **changes):
+        """
+        This method returns a copy with some keys changed, sharing the raw
+        text with the original (copy-on-write).
+        """
+        return Attributes(self.raw, {**self.edits, **changes} if self.edits else changes)
+
+    def __reduce__(self):
+        return Attributes, (self.raw, self.edits)
+
+    def __str__(self):
+        if not self.edits:
+            return self.raw
+
+        # The changed keys keep their position, the new keys are appended
+        edits = dict(self.edits)
+        pairs = []
+        for pair in self.raw.split(';'):
+            key = pair.partition('=')[0]
+            pairs.append(f"{key}={edits.pop(key)}" if key in edits else pair)
+        pairs.extend(f"{key}={value}" for key, value in edits.items())
+        return ';'.join(pairs)
+
+    def __repr__(self):
+        return f"Attributes({str(self)!r})"
+
+
+def attribute_column(df, key):
+    """
+    This function extracts the values of one attribute key of the df as a
+    string column (None where the key is missing).
+    """
+    import_pandas()
+    return pd.Series([attributes.get(key) for attributes in df['Attributes']], index=df.index, dtype=object)
+
+
+def parse_gff_line(line):
+    """
+    This function splits a single GFF line into the 9 GFF columns.
+
+    Returns: a feature list with integer coordinates and the Attributes,
+    or None if the line is empty, a comment or not a feature
+    """
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None
+    fields = line.split('\t')
+    if len(fields) < 9:
+        return None
+
+    return [
+        fields[0],
+        fields[1],
+        fields[2],
+        int(fields[3]),
+        int(fields[4]),
+        fields[5],
+        fields[6],
+        fields[7],
+        Attributes(fields[8])
     ]
 
-    gff_df = pd.DataFrame(gff_data, columns=columns)
-    return gff_df
 
+class GffFeature:
+    """
+    This class holds a feature of the streaming engine in fixed slots instead
+    of a list of the 9 columns: integer coordinates, an interned feature type,
+    the strand and phase packed into a small integer (see STRAND_PHASE_FLAGS)
+    and the Attributes.
+    """
+
+    __slots__ = ('seqname', 'source', 'type', 'start', 'end', 'score', 'flags', 'attributes')
+
+    def __init__(self, seqname, source, feature_type, start, end, score, flags, attributes):
+        self.seqname = seqname
+        self.source = source
+        self.type = feature_type
+        self.start = start
+        self.end = end
+        self.score = score
+        self.flags = flags
+        self.attributes = attributes
+
+    @property
+    def strand(self):
+        return STRANDS[self.flags & 3]
+
+    @property
+    def phase(self):
+        return PHASES[self.flags >> 2]
+
+    def copy(self, feature_type=None, attributes=None):
+        """
+        This method returns a copy of the feature, optionally with another
+        type or attributes.
+        """
+        return GffFeature(self.seqname, self.source, feature_type or self.type, self.start, self.end, self.score,
+                          self.flags, self.attributes if attributes is None else attributes)
+
+    def __reduce__(self):
+        return GffFeature, (self.seqname, self.source, self.type, self.start, self.end, self.score, self.flags,
+                            self.attributes)
+
+    def fields(self):
+        """
+        Returns: the 9 gff columns as a list
+        """
+        return [self.seqname, self.source, self.type, self.start, self.end, self.score, self.strand, self.phase,
+                self.attributes]
+
+    def __repr__(self):
+        return f"GffFeature({self.fields()!r})"
+
+
+class Vocabulary:
+    """
+    This class interns the values of a repeated gff field: every distinct
+    value is kept once and gets an integer code, in order of appearance.
+    """
+
+    def __init__(self, values=()):
+        self.codes = {}
+        self.values = []
+        for value in values:
+            self.code(value)
+
+    def code(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def intern(self, value):
+        """
+        Returns: the first stored copy of value, so that the features share it
+        """
+        return self.values[self.code(value)]
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        return iter(self.values)
+
+
+class GffVocabulary:
+    """
+    This class holds the vocabularies of the repeated fields of the parsed
+    features: contig names, sources and feature types. The feature types
+    written by the conversion come first, so they always exist as categories.
+    """
+
+    FIELDS = ('seqname', 'source', 'type')
+
+    def __init__(self):
+        self.seqname = Vocabulary()
+        self.source = Vocabulary()
+        self.type = Vocabulary(FEATURE_RANK)
+
+    def sizes(self):
+        """
+        Returns: number of distinct values of every field
+        """
+        return {field: len(getattr(self, field)) for field in self.FIELDS}
 
-def create_transcript_df(df):
+
+def parse_gff_feature(line, vocabulary=None):
+    """
+    This function parses a single GFF line into a GffFeature. With a
+    GffVocabulary, the contig name, source and type are interned in it.
+
+    Returns: a GffFeature, or None if the line is empty, a comment or not a feature
     """
-    This function go through the pandas df and copy each gene line and modify it to 
-    work as be used as a transcript line.
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None
+    fields = line.split('\t')
+    if len(fields) < 9:
+        return None
+
+    flags = STRAND_PHASE_FLAGS.get(fields[6] + fields[7])
+    if flags is None:
+        raise ValueError(f"Invalid strand {fields[6]!r} or phase {fields[7]!r}: {line}")
 
-    Returns: transcripts only pandas dataframe
+    if vocabulary is None:
+        return GffFeature(fields[0], fields[1], sys.intern(fields[2]), int(fields[3]), int(fields[4]), fields[5],
+                          flags, Attributes(fields[8]))
+    return GffFeature(vocabulary.seqname.intern(fields[0]), vocabulary.source.intern(fields[1]),
+                      vocabulary.type.intern(fields[2]), int(fields[3]), int(fields[4]), fields[5], flags,
+                      Attributes(fields[8]))
+
+
+class FeatureArrays:
     """
-    print("Creating transcript records ...\n")
-    modified_rows = []
-    # Iterate through the DataFrame
-    for index, row in df.iterrows():
-        if row['FeatureType'] == 'gene':
-            # Create a copy of the row
-            new_row = row.copy(deep=True)
-            # Change the "FeatureType" in the copied row
-            new_row['FeatureType'] = 'transcript'
-            # Append the modified row to the list
-            modified_rows.append(new_row)
-    
-    transcript_df = pd.DataFrame(modified_rows, index=None)
+    This class collects the parsed features of the pandas engine as a struct
+    of arrays: preallocated numpy arrays for the coordinates, the codes of the
+    contig, source and type in a GffVocabulary and the strand and phase codes
+    (see STRAND_PHASE_FLAGS), which double in size when they are full, and
+    lists for the score and attributes.
+    """
+
+    NUMERIC_COLUMNS = ('start', 'end', 'contig', 'source', 'feature_type', 'strand', 'phase')
+
+    def __init__(self, vocabulary=None, capacity=65536):
+        import_pandas()
+        self.vocabulary = vocabulary if vocabulary is not None else GffVocabulary()
+        self.size = 0
+        self.start = np.empty(capacity, np.int64)
+        self.end = np.empty(capacity, np.int64)
+        self.contig = np.empty(capacity, np.int32)
+        self.source = np.empty(capacity, np.int32)
+        self.feature_type = np.empty(capacity, np.int32)
+        self.strand = np.empty(capacity, np.int8)
+        self.phase = np.empty(capacity, np.int8)
+        self.score = []
+        self.attributes = []
+
+    def __len__(self):
+        return self.size
+
+    def append(self, feature):
+        """
+        This method adds a feature parsed by parse_gff_line.
+        """
+        if self.size == len(self.start):
+            self._grow(self.size + 1)
+        flags = STRAND_PHASE_FLAGS.get(feature[6] + feature[7])
+        if flags is None:
+            raise ValueError(f"Invalid strand {feature[6]!r} or phase {feature[7]!r} in {feature[0]}")
+
+        row = self.size
+        vocabulary = self.vocabulary
+        self.start[row] = feature[3]
+        self.end[row] = feature[4]
+        self.contig[row] = vocabulary.seqname.code(feature[0])
+        self.source[row] = vocabulary.source.code(feature[1])
+        self.feature_type[row] = vocabulary.type.code(feature[2])
+        self.strand[row] = flags & 3
+        self.phase[row] = flags >> 2
+        self.score.append(feature[5])
+        self.attributes.append(feature[8])
+        self.size += 1
 
-    # Now, let's modify the attributes of this df
-    for index, row in transcript_df.iterrows():
-        transcript_df.at[index, 'Attributes']['ID'] = transcript_df.at[index, 'Attributes']['ID'].replace('_gene', '_transcript')
-        transcript_df.at[index, 'Attributes']['Parent'] = transcript_df.at[index, 'Attributes']['ID'].replace('_transcript', '_gene')
-        transcript_df.at[index, 'Attributes']['biotype'] = 'protein_coding'
+    def extend(self, other):
+        """
+        This method adds the features of another FeatureArrays (e.g. parsed
+        from another chunk of the file), recoding them in this vocabulary.
+        """
+        if self.size + other.size > len(self.start):
+            self._grow(self.size + other.size)
+        rows = slice(self.size, self.size + other.size)
+        for name in ('start', 'end', 'strand', 'phase'):
+            getattr(self, name)[rows] = getattr(other, name)[:other.size]
+        for name, field in (('contig', 'seqname'), ('source', 'source'), ('feature_type', 'type')):
+            vocabulary = getattr(self.vocabulary, field)
+            recode = np.array([vocabulary.code(value) for value in getattr(other.vocabulary, field)], dtype=np.int32)
+            getattr(self, name)[rows] = recode[getattr(other, name)[:other.size]] if other.size else 0
+        self.score.extend(other.score)
+        self.attributes.extend(other.attributes)
+        self.size += other.size
 
-    return transcript_df
+    def _grow(self, capacity):
+        capacity = max(capacity, 2 * len(self.start))
+        for name in self.NUMERIC_COLUMNS:
+            array = getattr(self, name)
+            grown = np.empty(capacity, array.dtype)
+            grown[:self.size] = array[:self.size]
+            setattr(self, name, grown)
 
+    def __getstate__(self):
+        # Sent from the parsing worker processes without the unused capacity
+        # and with the attributes as raw text
+        state = self.__dict__.copy()
+        for name in self.NUMERIC_COLUMNS:
+            state[name] = state[name][:self.size]
+        state['attributes'] = [attributes.raw for attributes in self.attributes]
+        return state
 
-def modify_df(df):
+    def __setstate__(self, state):
+        state['attributes'] = [Attributes(attributes) for attributes in state['attributes']]
+        self.__dict__.update(state)
+
+    def to_dataframe(self):
+        """
+        This method returns the features as a dataframe with the GFF columns:
+        int64 Start/End, and SeqName, Source, FeatureType, Strand and Phase
+        as categoricals of the vocabulary codes.
+        """
+        rows = self.size
+        vocabulary = self.vocabulary
+        return pd.DataFrame({
+            'SeqName': pd.Categorical.from_codes(self.contig[:rows], vocabulary.seqname.values),
+            'Source': pd.Categorical.from_codes(self.source[:rows], vocabulary.source.values),
+            'FeatureType': pd.Categorical.from_codes(self.feature_type[:rows], vocabulary.type.values),
+            'Start': self.start[:rows],
+            'End': self.end[:rows],
+            'Score': self.score,
+            'Strand': pd.Categorical.from_codes(self.strand[:rows], STRANDS),
+            'Phase': pd.Categorical.from_codes(self.phase[:rows], PHASES),
+            'Attributes': pd.Series(self.attributes, dtype=object)
+        }, columns=GFF_COLUMNS)
+
+
+def read_gff_as_dataframe(gff_lines, vocabulary=None):
     """
-    This function takes the original gff df and change the attributes of the parents and the IDs
-    Returns: modified pandas dataframe
+    This function reads the gff feature lines and returns pandas dataframe.
+    The repeated fields are coded in vocabulary (a GffVocabulary) if given.
     """
-    
-    # Now, let's modify the attributes of this df
-    for index, row in df.iterrows():
-        if row['FeatureType'] == 'mRNA':
-            df.at[index, 'Attributes']['Parent'] = df.at[index, 'Attributes']['ID'].replace('_mRNA', '_transcript')
-            df.at[index, 'Attributes']['ID'] = df.at[index, 'Attributes']['ID'].replace('_mRNA', '_exon')
-            df.at[index, 'FeatureType'] = 'exon'
+    import_pandas()
+    print("Reading GFF file as pandas dataframe ...\n")
+    features = FeatureArrays(vocabulary)
 
-        elif row['FeatureType'] == 'CDS':
-            df.at[index, 'Attributes']['Parent'] = df.at[index, 'Attributes']['ID']+'_transcript'
-            df.at[index, 'Attributes']['ID'] = df.at[index, 'Attributes']['ID'] + '_cds'
-    
-    return df
+    for line in gff_lines:
+        feature_data = parse_gff_line(line)
+        if feature_data is not None:
+            features.append(feature_data)
 
+    return features.to_dataframe()
 
-def merge_gffs(df1, df2):
+
+def feature_section_end(input_file):
     """
-    This function merges the transcript df and the modified df
+    This function finds the byte offset where the fasta section of an
+    uncompressed prokka gff3 file starts (the first line starting with '>',
+    as in process_gff_file).
 
-    Returns: merged unsorted dataframe
+    Returns: offset of the fasta section, or the file size if there is none
     """
-    print("Merging GFF dataframes ... \n")
-    merged_df = pd.concat([df1, df2], ignore_index=True)
-    return merged_df
+    if os.path.getsize(input_file) == 0:
+        return 0
+    with open(input_file, 'rb') as input_f, mmap.mmap(input_f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        return fasta_offset(data)
 
 
-def reorder_gff(df):
+def split_feature_section(input_file, chunks):
     """
-    This function reorder the rows of the merged gff df
+    This function splits the feature section of an uncompressed gff3 file
+    (everything before the fasta sequences) into byte ranges at line
+    boundaries.
+
+    Returns: list of (start, end) byte offsets
     """
-    print("Reordering GFF rows ... \n")
-    df['SeqName'] = pd.to_numeric(df['SeqName'])
-    df['Start'] = pd.to_numeric(df['Start'])
-    df['End'] = pd.to_numeric(df['End'])
-
-
-    # Group rows by the 'Start' and 'End' columns
-    grouped = df.groupby(['Start', 'End'])
-    
-    reordered_rows = []
-    
-    for _, group in grouped:
-        # Sort rows within each group based on FeatureType
-        group = group.sort_values(by='FeatureType', key=lambda x: x.map({'gene': 0, 'transcript': 1, 'exon': 2, 'CDS': 3}))
-        
-        # Append the sorted rows to the reordered list
-        reordered_rows.extend(group.to_dict(orient='records'))
-    
-    # Create a new DataFrame with the reordered rows
-    reordered_df = pd.DataFrame(reordered_rows)
-    
-    # Reorder the DataFrame by 'SeqName', 'Start', and 'End'
-    reordered_df = reordered_df.sort_values(['SeqName', 'Start', 'End'], ascending=[True, True, True])
-
-    return reordered_df
-
-
-def non_coding_rna(df):
+    end = feature_section_end(input_file)
+    boundaries = [0]
+    with open(input_file, 'rb') as input_f:
+        for chunk in range(1, chunks):
+            input_f.seek(max(end * chunk // chunks, boundaries[-1]))
+            input_f.readline()
+            position = input_f.tell()
+            if position >= end:
+                break
+            if position > boundaries[-1]:
+                boundaries.append(position)
+    boundaries.append(end)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def parse_gff_chunk(task):
     """
-    This function removes the transcript lines related to the non-coding RNA 
-    genes and adds biotype as t/rRNA.
+    This function parses the feature lines of a byte range of a gff3 file
+    in a worker process.
 
-    Returns: modified gff dataframe
+    Returns: FeatureArrays of the features
     """
-    print("Processing the non-coding RNA ... \n")
-    drop_list = []
-    for index, row in df.iterrows():
+    input_file, start, end = task
+    with open(input_file, 'rb') as input_f:
+        input_f.seek(start)
+        data = input_f.read(end - start)
+
+    features = FeatureArrays()
+    # Only '\n' ends a line, as in process_gff_file (str.splitlines would also
+    # split the attributes on form feeds, \x85, \u2028, ...)
+    for line in data.decode().split('\n'):
+        feature_data = parse_gff_line(line.rstrip('\r'))
+        if feature_data is not None:
+            features.append(feature_data)
+    return features
+
+
+def read_gff_as_dataframe_parallel(input_file, workers, vocabulary=None):
+    """
+    This function reads an uncompressed gff3 file as a pandas dataframe by
+    splitting its feature section into chunks at line boundaries, parsing
+    them in a pool of worker processes and concatenating their FeatureArrays
+    (recoded in vocabulary, if given).
+    """
+    import_pandas()
+    print(f"Reading GFF file as pandas dataframe with {workers} workers ...\n")
+    tasks = [(input_file, start, end) for start, end in split_feature_section(input_file, workers * 4)]
 
-        if row['FeatureType'] == 'tRNA':
-            df.at[index, 'Attributes']['biotype'] = 'tRNA'
-            df.at[index, 'Attributes']['Parent'] = df.at[index, 'Attributes']['ID']+'_gene'
-            df.at[index-1, 'Attributes']['Parent'] = df.at[index, 'Attributes']['ID']+'_gene'
-            drop_list.append(index-2)
+    features = FeatureArrays(vocabulary)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        for chunk_features in executor.map(parse_gff_chunk, tasks):
+            features.extend(chunk_features)
 
-        elif row['FeatureType'] == 'rRNA':
-            df.at[index, 'Attributes']['biotype'] = 'rRNA'
-            df.at[index, 'Attributes']['Parent'] = df.at[index, 'Attributes']['ID']+'_gene'
-            df.at[index-1, 'Attributes']['Parent'] = df.at[index, 'Attributes']['ID']+'_gene'
-            drop_list.append(index-1)
-    
-    return df.drop(drop_list)
+    return features.to_dataframe()
 
 
-def write_gff_to_file(gff_dataframe, output_file_path):
+def compile_template(template):
     """
-    Write a GFF pandas DataFrame to a GFF3 file with formatted attributes.
+    This function splits an attribute template around '{locus}', so that it
+    is filled by a concatenation (see fill_template).
 
-    Parameters:
-        gff_dataframe (pd.DataFrame): The GFF DataFrame to be written.
-        output_file_path (str): The path to the output GFF3 file.
+    Returns: (prefix, suffix), suffix None for a template without '{locus}'
+    """
+    prefix, found, suffix = template.partition('{locus}')
+    return (prefix, suffix) if found else (prefix, None)
 
-    Returns:
-        None
+
+def fill_template(compiled, locus):
     """
-    print(f"Writing GFF file to {output_file_path} \n")
-    # Create a copy of the DataFrame to avoid modifying the original
-    formatted_df = gff_dataframe.copy()
+    This function fills a compiled template with a locus, or a string column
+    of loci.
+    """
+    prefix, suffix = compiled
+    return prefix if suffix is None else prefix + locus + suffix
 
-    # Format the 'Attributes' column with key=value pairs separated by semicolons
-    formatted_df['Attributes'] = formatted_df['Attributes'].apply(
-        lambda x: ';'.join([f"{key}={value}" for key, value in x.items()])
-    )
 
-    # Write the formatted DataFrame to a GFF3 file
-    formatted_df.to_csv(output_file_path, sep='\t', index=False, header=False, quoting=csv.QUOTE_NONE)
-    print("GFF conversion is done. Thanks for using prokka2vep!")
+def strip_suffix(feature_id, suffix):
+    """
+    This function removes the suffix of a prokka ID to get its locus.
+    """
+    return feature_id[:-len(suffix)] if suffix and feature_id.endswith(suffix) else feature_id
 
 
-def main():
-    parser = argparse.ArgumentParser(description='Convert prokka GFF to VEP-friendly GFF')
-    parser.add_argument('--gff', required=True, help='Input GFF file path')
-    parser.add_argument('--out', required=True, help='Output file path')
+class ConversionPlan:
+    """
+    This class compiles the conversion rules (see CONVERSION_RULES) once into
+    a dispatch table: for every prokka feature type, a function that converts
+    a GffFeature into its VEP records, and the compiled templates that the
+    dataframe functions apply to all the rows of that type at once.
+    """
 
-    args = parser.parse_args()
+    def __init__(self, rules=CONVERSION_RULES):
+        self.rules = {}
+        self.converters = {}
+        self.locus_rewrites = {}
+        id_suffixes = set()
+        for rule in rules:
+            templates = [(template['type'],
+                          [(key, compile_template(value)) for key, value in template.items() if key != 'type'])
+                         for template in rule['emit']]
+            suffix = rule.get('id_suffix', '')
+            self.rules[rule['type']] = (suffix, templates)
+            self.converters[rule['type']] = self._compile(suffix, templates)
+
+            rewrites = rule.get('locus_rewrites')
+            if rewrites:
+                self.locus_rewrites[templates[0][0]] = {
+                    feature_type: None if changes is None else
+                    [(key, compile_template(value)) for key, value in changes.items()]
+                    for feature_type, changes in rewrites.items()
+                }
+
+            for template in rule['emit']:
+                id_template = template.get('ID', '{locus}' + suffix)
+                if id_template.startswith('{locus}') and len(id_template) > len('{locus}'):
+                    id_suffixes.add(id_template[len('{locus}'):])
+
+        # Maps the ID of any VEP record back to its locus (see locus_column)
+        self.locus_pattern = '(' + '|'.join(map(re.escape, sorted(id_suffixes, key=len, reverse=True))) + ')$'
+
+    @staticmethod
+    def _compile(suffix, templates):
+        (first_type, first_changes), copies = templates[0], templates[1:]
+
+        def convert(feature):
+            attributes = feature.attributes
+            locus = strip_suffix(attributes['ID'], suffix)
+            records = [feature]
+            for feature_type, changes in copies:
+                records.append(feature.copy(feature_type, attributes.replace(
+                    **{key: fill_template(template, locus) for key, template in changes})))
+            feature.type = first_type
+            for key, template in first_changes:
+                attributes[key] = fill_template(template, locus)
+            return locus, records
 
-    input_gff = args.gff
-    output_gff = args.out
+        return convert
 
-    process_gff_file(input_gff, output_gff+'.tmp')
 
-    #gff_df = read_gff_as_dataframe(output_gff+'.tmp')
+CONVERSION_PLAN = ConversionPlan()
 
-    transcript_df = create_transcript_df(read_gff_as_dataframe(output_gff+'.tmp'))
-    
-    modified_df = modify_df(read_gff_as_dataframe(output_gff+'.tmp'))
 
-    merged_df = merge_gffs(transcript_df, modified_df)
+def feature_type_rows(df):
+    """
+    This function groups the row positions of the df by feature type in a
+    single pass, so that every conversion rule only visits its own rows.
+
+    Returns: dictionary of feature type -> array of row positions
+    """
+    return df.groupby('FeatureType', observed=True, sort=False).indices
+
+
+def set_feature_type(df, rows, feature_type):
+    """
+    This function sets the feature type of the rows (labels) of the df,
+    keeping a categorical column categorical.
+    """
+    column = df['FeatureType']
+    if isinstance(column.dtype, pd.CategoricalDtype) and feature_type not in column.cat.categories:
+        df['FeatureType'] = column.cat.add_categories([feature_type])
+    df.loc[rows, 'FeatureType'] = feature_type
+
+
+def rewrite_attributes(attributes, loci, changes):
+    """
+    This function applies compiled attribute templates to a sequence of
+    Attributes, given their loci.
+
+    Returns: list of the new (copy-on-write) Attributes
+    """
+    keys = [key for key, _ in changes]
+    # Filled one key at a time, as plain concatenations of the loci
+    columns = [itertools.repeat(prefix) if suffix is None else [prefix + locus + suffix for locus in loci]
+               for _, (prefix, suffix) in changes]
+    return [attribute.replace(**dict(zip(keys, values))) for attribute, *values in zip(attributes, *columns)]
+
+
+def rule_loci(attributes, suffix):
+    """
+    This function gets the loci of the prokka records of a conversion rule
+    from their IDs.
+
+    Returns: list of loci
+    """
+    return [strip_suffix(attribute['ID'], suffix) for attribute in attributes]
+
+
+def convert_df(df, plan=None):
+    """
+    This function converts the prokka records of the gff df into VEP records
+    in a single traversal of the rows of every conversion rule (see
+    ConversionPlan): the transcripts of the genes (the records of the other
+    templates) are created from the same loci as the ID and Parent rewrites of
+    the prokka records (the first template), with copy-on-write attributes, so
+    the input only has to be read once.
+
+    Returns: unsorted dataframe of the created records followed by the
+    converted prokka records
+    """
+    import_pandas()
+    print("Converting GFF records and creating transcripts ...\n")
+    plan = plan or CONVERSION_PLAN
+    type_rows = feature_type_rows(df)
+    attributes = df['Attributes'].to_numpy(copy=True)
+
+    created = []
+    for rule_type, (suffix, templates) in plan.rules.items():
+        if rule_type not in type_rows:
+            continue
+        positions = type_rows[rule_type]
+        rule_attributes = attributes[positions]
+        loci = rule_loci(rule_attributes, suffix)
+
+        for feature_type, changes in templates[1:]:
+            copy_df = df.iloc[positions].copy()
+            set_feature_type(copy_df, copy_df.index, feature_type)
+            copy_df['Attributes'] = pd.Series(rewrite_attributes(rule_attributes, loci, changes),
+                                              index=copy_df.index, dtype=object)
+            created.append(copy_df)
+
+        feature_type, changes = templates[0]
+        if changes:
+            attributes[positions] = rewrite_attributes(rule_attributes, loci, changes)
+        if feature_type != rule_type:
+            set_feature_type(df, df.index[positions], feature_type)
+
+    df['Attributes'] = pd.Series(attributes, index=df.index, dtype=object)
+    return pd.concat(created + [df], ignore_index=True)
+
+
+def natural_sort_key(name):
+    """
+    This function splits a contig name into text and integer parts, so that
+    contig_2 sorts before contig_10 and NODE_3_length_... before NODE_12_length_...
+    """
+    return tuple(int(part) if part.isdigit() else part for part in re.split(r'(\d+)', name))
+
+
+def read_contig_list(contig_file):
+    """
+    This function reads a user-supplied contig order from a samtools .fai
+    index, a gff3 file with ##sequence-region headers or a plain list with
+    one contig name per line.
+
+    Returns: list of contig names
+    """
+    sequence_regions = []
+    contigs = []
+    with open_gff(contig_file) as input_f:
+        for line in input_f:
+            if line.startswith('##sequence-region'):
+                sequence_regions.append(line.split()[1])
+                continue
+            line = line.strip()
+            if line.startswith('>'):
+                break  # Everything after the first sequence header is fasta
+            if not line or line.startswith('#'):
+                continue
+            if sequence_regions:
+                break  # The headers end at the first feature line
+            contigs.append(line.split('\t')[0])
+    return sequence_regions or list(dict.fromkeys(contigs))
+
+
+def contig_order_index(contigs, contig_order='natural', contig_list=None):
+    """
+    This function ranks the contig names once, so that the rows can be sorted
+    by an integer contig rank. The contigs are ranked by first appearance
+    ('input'), by natural sort ('natural') or by a user-supplied contig list;
+    contigs missing from that list are ranked after it.
+
+    Returns: dictionary mapping every contig name to its rank
+    """
+    contigs = list(dict.fromkeys(contigs))
+    if contig_list is not None:
+        ordered = list(dict.fromkeys(contig_list))
+        listed = set(ordered)
+        contigs = [contig for contig in contigs if contig not in listed]
+    else:
+        ordered = []
+
+    if contig_order == 'natural':
+        contigs.sort(key=natural_sort_key)
+
+    return {contig: rank for rank, contig in enumerate(ordered + contigs)}
+
+
+def reorder_gff(df, contig_order=None):
+    """
+    This function reorder the rows of the merged gff df by contig, coordinates
+    and feature rank (gene, transcript, exon, CDS, then the other features)
+    in a single stable sort. The contigs follow the ranks of contig_order
+    (see contig_order_index), by default their natural sort order. The ranks
+    are looked up once per distinct contig and feature type and the rows are
+    sorted with numpy.lexsort over the integer arrays.
+    """
+    import_pandas()
+    print("Reordering GFF rows ... \n")
+    seqnames = df['SeqName']
+    if contig_order is None:
+        contig_order = contig_order_index(seqnames.unique())
+
+    if isinstance(seqnames.dtype, pd.CategoricalDtype):
+        contig_codes, contigs = seqnames.cat.codes.to_numpy(), seqnames.cat.categories
+    else:
+        contig_codes, contigs = pd.factorize(seqnames)
+    # Categories without rows (e.g. contigs of a shared vocabulary) rank last
+    contig_rank = np.array([contig_order.get(contig, len(contig_order)) for contig in contigs],
+                           dtype=np.int64)[contig_codes]
+
+    type_codes, feature_types = pd.factorize(df['FeatureType'])
+    feature_rank = np.array([FEATURE_RANK.get(feature_type, len(FEATURE_RANK)) for feature_type in feature_types],
+                            dtype=np.int8)[type_codes]
+
+    start = df['Start'].to_numpy(dtype=np.int64)
+    end = df['End'].to_numpy(dtype=np.int64)
+
+    # lexsort is stable and sorts by the last key first
+    order = np.lexsort((feature_rank, end, start, contig_rank))
+    return df.take(order).reset_index(drop=True)
+
+
+def locus_column(df, plan=None):
+    """
+    This function maps every row of the df to its locus, i.e. its ID without
+    the _gene/_transcript/_exon/_cds suffix (ABC_00001_exon -> ABC_00001), as
+    given by the IDs of the conversion rules. The tRNA and rRNA features carry
+    the bare locus as their ID.
+
+    Returns: locus column (NaN for the features without ID)
+    """
+    plan = plan or CONVERSION_PLAN
+    return attribute_column(df, 'ID').str.replace(plan.locus_pattern, '', regex=True)
+
+
+def non_coding_rna(df, plan=None):
+    """
+    This function removes the transcript lines related to the non-coding RNA 
+    genes and attaches their exons to the gene (the locus_rewrites of the
+    conversion rules, see ConversionPlan). The records of a locus are linked
+    through a hash index of the loci, so the row order does not matter.
+
+    Returns: modified gff dataframe
+    """
+    import_pandas()
+    print("Processing the non-coding RNA ... \n")
+    plan = plan or CONVERSION_PLAN
+    loci = locus_column(df, plan)
+    type_rows = feature_type_rows(df)
+    attributes = df['Attributes'].to_numpy(copy=True)
+    dropped = np.zeros(len(df), dtype=bool)
+
+    for trigger_type, rewrites in plan.locus_rewrites.items():
+        if trigger_type not in type_rows:
+            continue
+        trigger_loci = pd.Index(loci.iloc[type_rows[trigger_type]].dropna().unique())
+
+        for feature_type, changes in rewrites.items():
+            if feature_type not in type_rows:
+                continue
+            positions = type_rows[feature_type]
+            positions = positions[loci.iloc[positions].isin(trigger_loci).to_numpy()]
+            if changes is None:
+                dropped[positions] = True
+                continue
+            attributes[positions] = rewrite_attributes(attributes[positions], loci.iloc[positions], changes)
+
+    df['Attributes'] = pd.Series(attributes, index=df.index, dtype=object)
+    return df[~dropped]
+
+
+def write_gff_to_file(gff_dataframe, output_file_path, bgzip=False, index='tbi'):
+    """
+    Write a GFF pandas DataFrame to a GFF3 file with formatted attributes.
+
+    Parameters:
+        gff_dataframe (pd.DataFrame): The GFF DataFrame to be written.
+        output_file_path (str): The path to the output GFF3 file.
+        bgzip (bool): Write a BGZF compressed file instead of plain text.
+        index (str): Index of the BGZF file: 'tbi', 'csi' or None.
+
+    Returns:
+        None
+    """
+    print(f"Writing GFF file to {output_file_path} \n")
+    # The rows are joined straight from the column lists, in chunks, without
+    # copying the dataframe; unchanged attributes are written as their raw text
+    columns = [gff_dataframe[column].tolist() for column in GFF_COLUMNS]
+    for position in (3, 4, 8):  # Start, End, Attributes
+        columns[position] = map(str, columns[position])
+    rows = zip(*columns)
+
+    if bgzip:
+        output = open_gff_output(output_file_path, bgzip, index)
+    else:
+        output = open(output_file_path, 'w', buffering=WRITE_BUFFER_SIZE)
+
+    with output as output_f:
+        while True:
+            lines = [('\t'.join(row) + '\n') for row in itertools.islice(rows, WRITE_CHUNK_ROWS)]
+            if not lines:
+                break
+            if bgzip:
+                output_f.writelines(lines)
+            else:
+                output_f.write(''.join(lines))
+    print("GFF conversion is done. Thanks for using prokka2vep!")
+
+
+class ColumnarWriter:
+    """
+    This class writes the VEP records as a Parquet or Arrow IPC file in
+    batches, with integer Start/End columns and dictionary encoded SeqName,
+    Source, FeatureType and Strand columns. The dictionaries only grow from
+    one batch to the next, so that the Arrow file stores them as deltas.
+    """
+
+    def __init__(self, path, columnar_format='parquet', batch_size=65536):
+        pa = import_pyarrow()
+        self._pa = pa
+        fields = []
+        for column in GFF_COLUMNS:
+            if column in ('Start', 'End'):
+                fields.append(pa.field(column, pa.int64()))
+            elif column in DICTIONARY_COLUMNS:
+                fields.append(pa.field(column, pa.dictionary(pa.int32(), pa.string())))
+            else:
+                fields.append(pa.field(column, pa.string()))
+        self.schema = pa.schema(fields)
+        if columnar_format == 'arrow':
+            options = pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True)
+            self._writer = pa.ipc.new_file(path, self.schema, options=options)
+        else:
+            self._writer = pa.parquet.ParquetWriter(path, self.schema)
+        self.batch_size = batch_size
+        self.rows = 0
+        self._columns = [[] for _ in GFF_COLUMNS]
+        self._vocabularies = {column: {} for column in DICTIONARY_COLUMNS}
+
+    def write(self, record):
+        columns = self._columns
+        fields = record.fields()
+        for position in range(8):
+            columns[position].append(fields[position])
+        columns[8].append(str(fields[8]))
+        if len(columns[0]) >= self.batch_size:
+            self._write_batch()
+
+    def write_dataframe(self, gff_dataframe):
+        for start in range(0, len(gff_dataframe), self.batch_size):
+            chunk = gff_dataframe.iloc[start:start + self.batch_size]
+            self._columns = [chunk[column].tolist() for column in GFF_COLUMNS[:8]]
+            self._columns.append(list(map(str, chunk['Attributes'])))
+            self._write_batch()
+
+    def _write_batch(self):
+        pa = self._pa
+        if not self._columns[0]:
+            return
+        arrays = []
+        for field, values in zip(self.schema, self._columns):
+            vocabulary = self._vocabularies.get(field.name)
+            if vocabulary is not None:
+                codes = [vocabulary.setdefault(value, len(vocabulary)) for value in values]
+                arrays.append(pa.DictionaryArray.from_arrays(pa.array(codes, pa.int32()),
+                                                             pa.array(list(vocabulary), pa.string())))
+            else:
+                arrays.append(pa.array(values, field.type))
+        self._writer.write_batch(pa.record_batch(arrays, schema=self.schema))
+        self.rows += len(self._columns[0])
+        self._columns = [[] for _ in GFF_COLUMNS]
+
+    def close(self):
+        self._write_batch()
+        self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def write_columnar(gff_dataframe, output_file_path, columnar_format='parquet'):
+    """
+    This function writes the VEP-shaped gff dataframe as a Parquet or Arrow
+    IPC file (see ColumnarWriter).
+    """
+    print(f"Writing {columnar_format} file to {output_file_path} \n")
+    with ColumnarWriter(output_file_path, columnar_format) as columnar_writer:
+        columnar_writer.write_dataframe(gff_dataframe)
+
+
+def convert_locus(features, plan=None):
+    """
+    This function converts the buffered prokka features that start at the
+    same position into VEP records with the conversion rules (see
+    ConversionPlan): every gene gets a transcript, mRNAs become exons, CDSs
+    are re-parented to the transcript, and the transcripts of the non-coding
+    RNA genes are dropped.
+
+    Returns: list of VEP records sorted by end and feature rank
+    """
+    plan = plan or CONVERSION_PLAN
+    converters = plan.converters
+    records = []
+    loci = []
+    rewrites = {}
+    for feature in features:
+        convert = converters.get(feature.type)
+        if convert is None:
+            records.append(feature)
+            loci.append(None)
+            continue
+
+        locus, converted = convert(feature)
+        for record in converted:
+            records.append(record)
+            loci.append(locus)
+            if record.type in plan.locus_rewrites:
+                rewrites[locus] = plan.locus_rewrites[record.type]
+
+    if rewrites:
+        kept = []
+        for locus, record in zip(loci, records):
+            locus_rewrites = rewrites.get(locus)
+            if locus_rewrites is not None and record.type in locus_rewrites:
+                changes = locus_rewrites[record.type]
+                if changes is None:
+                    continue
+                for key, template in changes:
+                    record.attributes[key] = fill_template(template, locus)
+            kept.append(record)
+        records = kept
+
+    records.sort(key=lambda record: (record.end, FEATURE_RANK.get(record.type, len(FEATURE_RANK))))
+    return records
+
+
+def group_loci(features):
+    """
+    This function groups the GffFeatures (None for the skipped lines)
+    that share a contig and a start position, which is what convert_locus
+    needs. Prokka writes the features of every contig in coordinate order,
+    so only one group is kept in memory.
+
+    Returns: a generator of feature lists
+    """
+    buffer = []
+    for feature in features:
+        if feature is None:
+            continue
+
+        if buffer:
+            seqname, start = buffer[0].seqname, buffer[0].start
+            if feature.seqname != seqname or feature.start > start:
+                yield buffer
+                buffer = []
+            elif feature.start < start:
+                raise ValueError(f"The features of {seqname} are not sorted by start "
+                                 f"({feature.start} after {start}), use --engine pandas")
+        buffer.append(feature)
+
+    if buffer:
+        yield buffer
+
+
+def format_gff_record(record):
+    """
+    This function formats a VEP record (GffFeature) as a tab separated GFF3 line.
+    """
+    return (f"{record.seqname}\t{record.source}\t{record.type}\t{record.start}\t{record.end}\t{record.score}\t"
+            f"{STRANDS[record.flags & 3]}\t{PHASES[record.flags >> 2]}\t{record.attributes}\n")
+
+
+class RecordOutput:
+    """
+    This class writes the VEP records as gff lines, and also to a
+    ColumnarWriter if there is one.
+    """
+
+    def __init__(self, output_f, columnar_writer=None):
+        self.output_f = output_f
+        self.columnar_writer = columnar_writer
+
+    def write(self, record):
+        self.output_f.write(format_gff_record(record))
+        if self.columnar_writer is not None:
+            self.columnar_writer.write(record)
+
+    def writelines(self, records):
+        for record in records:
+            self.write(record)
+
+
+class ContigOrderedWriter:
+    """
+    This class writes the converted records contig by contig in the requested
+    contig order. The contig that is next in line is written straight through;
+    a contig that comes earlier in the input than its turn is held until all
+    the contigs ranked before it are written. Once more than PENDING_ROWS
+    records are held, they are pickled to a temporary file, so the memory use
+    stays flat whatever the order of the input contigs. The contig order is
+    computed when the first contig starts, from header_contigs: the list of
+    the ##sequence-region headers that process_gff_file fills while the input
+    is read. A header contig is only known to have no features when the input
+    ends, so the contigs ranked after it are held until then. In input order
+    (without a contig list) every contig is written straight through.
+    """
+
+    def __init__(self, output_f, header_contigs, contig_order='natural', contig_list=None, item_rows=None):
+        self.output_f = output_f
+        self.header_contigs = header_contigs
+        self.contig_order = contig_order
+        self.contig_list = contig_list
+        self.expected = None
+        self.position = 0
+        self.done = set()
+        self.pending = {}  # contig: [offsets of the spilled lists, records in memory]
+        self.pending_rows = 0
+        self.item_rows = item_rows
+        self._spill = None
+        self.current = None
+        self.direct = False
+
+    def start_contig(self, contig):
+        if self.expected is None:
+            # The ##sequence-region headers have all been read with the first feature
+            self.expected = expected_contig_order(self.header_contigs, self.contig_order, self.contig_list)
+
+        if contig in self.done or contig in self.pending:
+            raise ValueError(f"The features of {contig} are not grouped together, use --engine pandas")
+
+        self.current = contig
+        self.direct = self.expected is None or (self.position < len(self.expected)
+                                                and self.expected[self.position] == contig)
+        if not self.direct:
+            self.pending[contig] = [[], []]
+
+    def write(self, record):
+        if self.direct:
+            self.output_f.write(record)
+            return
+
+        self.pending[self.current][1].append(record)
+        self.pending_rows += 1 if self.item_rows is None else self.item_rows(record)
+        if self.pending_rows > PENDING_ROWS:
+            self._spill_pending()
+
+    def writelines(self, records):
+        for record in records:
+            self.write(record)
+
+    def end_contig(self):
+        self.done.add(self.current)
+        self.current = None
+        self._advance()
+
+    def close(self):
+        """
+        This method writes the remaining contigs, including the ones missing
+        from the expected contig list.
+        """
+        self.done.update(self.expected or ())
+        self._advance()
+        remaining = list(self.pending)
+        if self.contig_order == 'natural':
+            remaining.sort(key=natural_sort_key)
+        for contig in remaining:
+            self._write_pending(contig)
+        if self._spill is not None:
+            self._spill.close()
+
+    def _advance(self):
+        if self.expected is None:
+            return
+        while self.position < len(self.expected) and self.expected[self.position] in self.done:
+            if self.expected[self.position] in self.pending:
+                self._write_pending(self.expected[self.position])
+            self.position += 1
+
+    def _spill_pending(self):
+        """
+        This method appends the records held in memory to the temporary file,
+        one pickled list per contig.
+        """
+        if self._spill is None:
+            self._spill = tempfile.TemporaryFile(prefix='prokka2vep.')
+        self._spill.seek(0, os.SEEK_END)
+        for spilled, records in self.pending.values():
+            if records:
+                spilled.append(self._spill.tell())
+                pickle.dump(records, self._spill, pickle.HIGHEST_PROTOCOL)
+                records.clear()
+        self.pending_rows = 0
+
+    def _write_pending(self, contig):
+        spilled, records = self.pending.pop(contig)
+        for offset in spilled:
+            self._spill.seek(offset)
+            self.output_f.writelines(pickle.load(self._spill))
+        self.output_f.writelines(records)
+        self.pending_rows -= len(records) if self.item_rows is None else sum(map(self.item_rows, records))
+
+
+def expected_contig_order(header_contigs, contig_order='natural', contig_list=None):
+    """
+    This function lists the contigs of the ##sequence-region headers in the
+    order they must be written (see contig_order_index).
+
+    Returns: list of contigs in output order, or None if the contigs are
+    written in input order
+    """
+    if contig_order == 'input':
+        # The contigs missing from the list follow in input order
+        return None if contig_list is None else list(dict.fromkeys(contig_list))
+    return list(contig_order_index(header_contigs, contig_order, contig_list))
+
+
+def stream_convert(input_file, output_file, contig_order='natural', contig_list=None, bgzip=False, index='tbi',
+                   profiler=None, fasta_out=None, columnar_out=None, columnar_format='parquet', vocabulary=None):
+    """
+    This function converts the prokka gff3 file in a single pass without
+    building any dataframe. Prokka writes the features of every contig in
+    coordinate order, so only the features sharing the current start position
+    are kept in memory before they are converted and written out. When the
+    input contigs are not in the requested contig order (see
+    contig_order_index), the contigs written out of turn are held back, in a
+    temporary file once there are many of them (see ContigOrderedWriter).
+    With bgzip the output is BGZF compressed and indexed (see open_gff_output).
+    With a StageProfiler, the reading of the input lines is profiled as well.
+    With fasta_out, the fasta section is written to an indexed BGZF fasta in
+    the same pass (see BgzfFastaWriter), and with columnar_out the records are
+    also written as Parquet or Arrow (see ColumnarWriter). The contig names,
+    sources and types are interned in vocabulary (a new GffVocabulary by
+    default).
+
+    Returns: number of records written
+    """
+    print(f"Streaming GFF conversion to {output_file} ...\n")
+    parse_feature = functools.partial(parse_gff_feature, vocabulary=vocabulary or GffVocabulary())
+    header_contigs = []
+
+    written = 0
+
+    with contextlib.ExitStack() as outputs:
+        output_f = outputs.enter_context(open_gff_output(output_file, bgzip, index))
+        fasta_writer = outputs.enter_context(BgzfFastaWriter(fasta_out)) if fasta_out else None
+        columnar_writer = outputs.enter_context(ColumnarWriter(columnar_out, columnar_format)) if columnar_out else None
+        # Without columnar output the records are formatted before they are
+        # ordered, so that the contigs written out of turn are spilled as text
+        output = RecordOutput(output_f, columnar_writer) if columnar_writer else output_f
+        writer = ContigOrderedWriter(output, header_contigs, contig_order, contig_list)
+
+        feature_lines = process_gff_file(input_file, fasta_writer, header_contigs)
+        if profiler is not None:
+            feature_lines = profiler.iterate('process_gff_file', feature_lines)
+
+        for locus in group_loci(map(parse_feature, feature_lines)):
+            seqname = locus[0].seqname
+            if seqname != writer.current:
+                if writer.current is not None:
+                    writer.end_contig()
+                writer.start_contig(seqname)
+            records = convert_locus(locus)
+            writer.writelines(records if columnar_writer else map(format_gff_record, records))
+            written += len(records)
+
+        if writer.current is not None:
+            writer.end_contig()
+        writer.close()
+
+    print("GFF conversion is done. Thanks for using prokka2vep!")
+    return written
+
+
+def group_contig_lines(feature_lines):
+    """
+    This function groups the raw feature lines of every contig.
+
+    Returns: a generator of (contig, list of lines)
+    """
+    contig = None
+    lines = []
+    for line in feature_lines:
+        line = line.strip()
+        if not line:
+            continue
+        seqname = line.split('\t', 1)[0]
+        if seqname != contig:
+            if lines:
+                yield contig, lines
+            contig = seqname
+            lines = []
+        lines.append(line)
+    if lines:
+        yield contig, lines
+
+
+def read_manifest(output_file, options):
+    """
+    This function reads the per-contig manifest (<output>.p2v.json) of a
+    previous incremental conversion. The manifest is ignored if it was
+    written by another version or with other options, or if the output was
+    changed since.
+
+    Returns: dictionary of the contig entries, empty if there is no usable manifest
+    """
+    try:
+        with open(output_file + MANIFEST_SUFFIX, 'r') as manifest_f:
+            manifest = json.load(manifest_f)
+        if (manifest['version'] != __version__ or manifest['options'] != options
+                or manifest['size'] != os.path.getsize(output_file)):
+            return {}
+        return manifest['contigs']
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+def write_manifest(output_file, options, contigs):
+    """
+    This function writes the per-contig manifest of an incremental
+    conversion next to its output.
+    """
+    manifest = {'version': __version__, 'options': options, 'size': os.path.getsize(output_file),
+                'contigs': contigs}
+    with open(output_file + MANIFEST_SUFFIX, 'w') as manifest_f:
+        json.dump(manifest, manifest_f)
+
+
+class SplicedGffOutput:
+    """
+    This class writes the contigs of an incremental conversion, given as
+    (contig, digest, lines) chunks: the reconverted contigs from their new
+    lines, and the unchanged ones (lines None) as a copy of their byte range
+    in the previous output. With bgzip every contig starts a new BGZF block,
+    so that the blocks of an unchanged contig are copied as they are and its
+    index entries are only shifted. The output is written to a uniquely named
+    temporary file next to it, which replaces the previous output when it is
+    closed.
+    """
+
+    def __init__(self, output_file, previous=None, bgzip=False, index='tbi'):
+        self.output_file = output_file
+        self.bgzip = bgzip
+        self.index = index
+        self.previous = previous or {}
+        self.contigs = {}
+        self.converted = 0
+        self.copied = 0
+        temp_fd, self._temp_file = tempfile.mkstemp(dir=os.path.dirname(output_file) or '.',
+                                                    prefix=f'.{os.path.basename(output_file)}.', suffix='.tmp')
+        self._previous_f = open(output_file, 'rb') if self.previous else None
+        if bgzip:
+            os.close(temp_fd)
+            self._output_f = BgzfGffWriter(self._temp_file, index)
+        else:
+            self._output_f = os.fdopen(temp_fd, 'wb')
+
+    def write(self, chunk):
+        contig, digest, lines = chunk
+        start = self._output_f.start_block() if self.bgzip else self._output_f.tell()
+
+        if lines is None:
+            entry = self.previous[contig]
+            self._previous_f.seek(entry['start'])
+            data = self._previous_f.read(entry['end'] - entry['start'])
+            length = entry['length']
+            if self.bgzip:
+                self._output_f.copy_contig(contig, data, length, entry.get('index'), start - entry['start'])
+            else:
+                self._output_f.write(data)
+            self.copied += 1
+        else:
+            length = 0
+            for line in lines:
+                data = line.encode()
+                length += len(data)  # Uncompressed size in bytes, see BgzfWriter.copy_blocks
+                self._output_f.write(line if self.bgzip else data)
+            self.converted += 1
+
+        end = self._output_f.start_block() if self.bgzip else self._output_f.tell()
+        self.contigs[contig] = {'digest': digest, 'start': start, 'end': end, 'length': length}
+        if self.bgzip:
+            self.contigs[contig]['index'] = self._output_f.contig_index(contig)
+
+    def writelines(self, chunks):
+        for chunk in chunks:
+            self.write(chunk)
+
+    def close(self):
+        self._output_f.close()
+        if self._previous_f is not None:
+            self._previous_f.close()
+        # mkstemp creates the file for its owner only, the output gets the usual permissions
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(self._temp_file, 0o666 & ~umask)
+        os.replace(self._temp_file, self.output_file)
+        if self.bgzip and self.index:
+            os.replace(f'{self._temp_file}.{self.index}', f'{self.output_file}.{self.index}')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.close()
+            return
+        if self.bgzip:
+            self._output_f.__exit__(exc_type, *exc_info)
+        else:
+            self._output_f.close()
+        if self._previous_f is not None:
+            self._previous_f.close()
+        os.remove(self._temp_file)
+
+
+def incremental_convert(input_file, output_file, contig_order='natural', contig_list=None, bgzip=False,
+                        index='tbi', profiler=None, fasta_out=None, vocabulary=None):
+    """
+    This function converts the prokka gff3 file like stream_convert, but only
+    reconverts the contigs whose feature lines changed since the previous
+    incremental conversion to the same output. A blake2b digest of the lines
+    of every contig is kept in a manifest next to the output, and the output
+    of the unchanged contigs is copied from the previous output instead (see
+    SplicedGffOutput). The vocabulary is used as in stream_convert.
+
+    Returns: number of contigs converted again
+    """
+    print(f"Incremental GFF conversion to {output_file} ...\n")
+    parse_feature = functools.partial(parse_gff_feature, vocabulary=vocabulary or GffVocabulary())
+    header_contigs = []
+    options = {'contig_order': contig_order, 'contig_list': contig_list, 'bgzip': bgzip, 'index': index}
+    previous = read_manifest(output_file, options)
+
+    with SplicedGffOutput(output_file, previous, bgzip, index) as output_f, \
+            (BgzfFastaWriter(fasta_out) if fasta_out else contextlib.nullcontext()) as fasta_writer:
+        # A contig is held as a single (contig, digest, lines) chunk
+        writer = ContigOrderedWriter(output_f, header_contigs, contig_order, contig_list,
+                                     item_rows=lambda chunk: 1 + len(chunk[2] or ()))
+
+        feature_lines = process_gff_file(input_file, fasta_writer, header_contigs)
+        if profiler is not None:
+            feature_lines = profiler.iterate('process_gff_file', feature_lines)
+
+        for contig, lines in group_contig_lines(feature_lines):
+            digest = hashlib.blake2b('\n'.join(lines).encode(), digest_size=20).hexdigest()
+            writer.start_contig(contig)
+            if contig in previous and previous[contig]['digest'] == digest:
+                writer.write((contig, digest, None))
+            else:
+                records = [format_gff_record(record) for locus in group_loci(map(parse_feature, lines))
+                           for record in convert_locus(locus)]
+                writer.write((contig, digest, records))
+            writer.end_contig()
+        writer.close()
+
+    write_manifest(output_file, options, output_f.contigs)
+
+    print(f"{output_f.converted} contigs converted, {output_f.copied} copied from the previous output.\n")
+    print("GFF conversion is done. Thanks for using prokka2vep!")
+    return output_f.converted
+
+
+def reset_peak_rss():
+    """
+    This function resets the peak resident memory of the process where the
+    system allows it (Linux), so that the peak of each stage can be measured.
+
+    Returns: True if the peak was reset
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    """
+    This function returns the peak resident memory of the process in MB
+    (since the last reset_peak_rss on Linux), or None if it is unknown.
+    """
+    try:
+        with open('/proc/self/status', 'r') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class StageProfiler:
+    """
+    This class records the wall time, CPU time, peak RSS and number of rows
+    of every stage of a conversion and writes them as a JSON report. When it
+    is disabled, the stages are just run.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.stages = []
+        self.per_stage_peak = False
+
+    def run(self, stage, function, *args):
+        """
+        This method runs function(*args) as a stage. The rows are the length
+        of the result, the result itself if it is a count, or else the length
+        of the first argument (none for string and boolean results).
+
+        Returns: the result of the function
+        """
+        if not self.enabled:
+            return function(*args)
+
+        self.per_stage_peak = reset_peak_rss()
+        started_wall = time.perf_counter()
+        started_cpu = time.process_time()
+        result = function(*args)
+        wall = time.perf_counter() - started_wall
+        cpu = time.process_time() - started_cpu
+
+        if isinstance(result, (str, bool)):  # Not rows (e.g. a digest or a cache hit)
+            rows = None
+        elif hasattr(result, '__len__'):
+            rows = len(result)
+        elif isinstance(result, int):
+            rows = result
+        elif args and hasattr(args[0], '__len__'):
+            rows = len(args[0])
+        else:
+            rows = None
+        self._record(stage, wall, cpu, rows)
+        return result
+
+    def iterate(self, stage, iterable):
+        """
+        This method profiles a lazy stage (a generator) by timing every item
+        it yields. Its time is also part of the stage that consumes it.
+        """
+        if not self.enabled:
+            yield from iterable
+            return
+
+        wall = 0.0
+        cpu = 0.0
+        rows = 0
+        iterator = iter(iterable)
+        while True:
+            started_wall = time.perf_counter()
+            started_cpu = time.process_time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                wall += time.perf_counter() - started_wall
+                cpu += time.process_time() - started_cpu
+            rows += 1
+            yield item
+        self._record(stage, wall, cpu, rows)
+
+    def _record(self, stage, wall, cpu, rows):
+        self.stages.append({
+            'stage': stage,
+            'wall_seconds': round(wall, 6),
+            'cpu_seconds': round(cpu, 6),
+            'peak_rss_mb': peak_rss_mb(),
+            'rows': rows
+        })
+
+    def report(self, **run_info):
+        return {
+            **run_info,
+            'peak_rss_scope': 'stage' if self.per_stage_peak else 'process',
+            'stages': self.stages
+        }
+
+    def write(self, path, **run_info):
+        """
+        This method writes the JSON report to path, or to stderr for '-'.
+        """
+        report = json.dumps(self.report(**run_info), indent=2)
+        if path == '-':
+            print(report, file=sys.stderr)
+        else:
+            with open(path, 'w') as report_f:
+                report_f.write(report + '\n')
+
+
+def parse_size(size):
+    """
+    This function reads a size in bytes with an optional K, M, G or T
+    suffix, e.g. 500M or 10G.
+
+    Returns: size in bytes
+    """
+    size = str(size).strip().upper().rstrip('B')
+    unit = size[-1:] if size[-1:] in CACHE_SIZE_UNITS else ''
+    return int(float(size[:len(size) - len(unit)]) * CACHE_SIZE_UNITS[unit])
+
+
+def file_digest(input_file, chunk_size=1 << 20):
+    """
+    This function hashes the content of a file with blake2b.
+
+    Returns: hex digest
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    with open(input_file, 'rb') as input_f:
+        for chunk in iter(lambda: input_f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(input_gff, options):
+    """
+    This function computes the cache key of a conversion from the content
+    of the input, the prokka2vep version and the options that change the
+    output.
+
+    Returns: hex digest
+    """
+    key = json.dumps({'input': file_digest(input_gff), 'version': __version__, **options}, sort_keys=True)
+    return hashlib.blake2b(key.encode(), digest_size=20).hexdigest()
+
+
+def conversion_outputs(output_gff, bgzip=False, index='tbi', fasta_out=None, columnar_out=None):
+    """
+    This function lists the files written by a conversion.
+
+    Returns: list of (name in the cache, path) pairs
+    """
+    outputs = [('gff', output_gff)]
+    if bgzip and index:
+        outputs.append((f'gff.{index}', f'{output_gff}.{index}'))
+    if fasta_out:
+        outputs += [('fasta', fasta_out), ('fasta.fai', fasta_out + '.fai'), ('fasta.gzi', fasta_out + '.gzi')]
+    if columnar_out:
+        outputs.append(('columnar', columnar_out))
+    return outputs
+
+
+def fetch_cached_output(cache_dir, key, outputs):
+    """
+    This function copies the cached files of a conversion to their output
+    paths and marks the cache entry as recently used.
+
+    Returns: True if the conversion was found in the cache
+    """
+    entry = os.path.join(cache_dir, key)
+    if not os.path.isdir(entry):
+        return False
+    try:
+        for name, path in outputs:
+            shutil.copyfile(os.path.join(entry, name), path)
+        os.utime(entry)
+    except OSError:  # Incomplete, or evicted by another process meanwhile
+        return False
+    return True
+
+
+def store_cached_output(cache_dir, key, outputs, cache_size):
+    """
+    This function copies the files of a conversion into the cache, then
+    evicts the least recently used entries until the cache fits in
+    cache_size bytes. Entries are written to a temporary directory and
+    renamed, so that concurrent batch workers never see a partial entry.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    entry = os.path.join(cache_dir, key)
+    staging = os.path.join(cache_dir, f'.{key}.{os.getpid()}')
+    os.makedirs(staging, exist_ok=True)
+    for name, path in outputs:
+        shutil.copyfile(path, os.path.join(staging, name))
+    try:
+        os.rename(staging, entry)
+    except OSError:  # Already stored by another process
+        shutil.rmtree(staging, ignore_errors=True)
+    evict_cache(cache_dir, cache_size)
+
+
+def evict_cache(cache_dir, cache_size):
+    """
+    This function removes the least recently used cache entries until the
+    total size of the cache is at most cache_size bytes.
+    """
+    entries = []
+    with os.scandir(cache_dir) as scan:
+        for entry in scan:
+            if entry.name.startswith('.') or not entry.is_dir():
+                continue
+            try:
+                size = sum(f.stat().st_size for f in os.scandir(entry.path))
+                entries.append((entry.stat().st_mtime, size, entry.path))
+            except OSError:
+                continue
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= cache_size:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+
+
+def convert_gff(input_gff, output_gff, engine='stream', contig_order='natural', contig_list=None,
+                bgzip=False, index='tbi', profile=None, parse_workers=1, fasta_out=None, cache_dir=None,
+                cache_size='10G', incremental=False, columnar_out=None, columnar_format='parquet'):
+    """
+    This function converts one prokka gff3 file into a VEP-friendly gff3 file
+    with the requested engine (see main for the options). With profile (a
+    path, or '-' for stderr) the stages are profiled into a JSON report. With
+    fasta_out, the embedded fasta sequences are extracted to an indexed BGZF
+    fasta. With cache_dir, the outputs of an input already converted with the
+    same options are copied from the cache instead (see cache_key). With
+    incremental (stream engine only), the contigs that did not change since
+    the previous conversion are copied from the previous output (see
+    incremental_convert). With columnar_out, the records are also written as
+    Parquet or Arrow (columnar_format).
+
+    Returns: True if the outputs came from the cache
+    """
+    profiler = StageProfiler(enabled=bool(profile))
+
+    if cache_dir and not is_regular_file(input_gff):
+        # Hashing a pipe would consume it before the conversion
+        print(f"{input_gff} is not a regular file, the cache is not used\n")
+        cache_dir = None
+
+    if cache_dir:
+        outputs = conversion_outputs(output_gff, bgzip, index, fasta_out, columnar_out)
+        key = profiler.run('cache_key', cache_key, input_gff,
+                           {'engine': engine, 'contig_order': contig_order, 'contig_list': contig_list,
+                            'bgzip': bgzip, 'index': index, 'fasta': bool(fasta_out),
+                            'columnar': columnar_format if columnar_out else None})
+        if profiler.run('fetch_cached_output', fetch_cached_output, cache_dir, key, outputs):
+            print(f"Copied the cached conversion of {input_gff} to {output_gff}\n")
+            if profile:
+                profiler.write(profile, input=input_gff, output=output_gff, engine='cache')
+            return True
+
+    # The repeated fields of the input (contig, source, type) are interned in
+    # a single vocabulary
+    vocabulary = GffVocabulary()
+
+    def read_gff(fasta_writer=None):
+        if parse_workers > 1 and is_mappable(input_gff):
+            if fasta_writer is not None:
+                profiler.run('extract_fasta', extract_fasta, input_gff, fasta_writer)
+            return profiler.run('read_gff_as_dataframe', read_gff_as_dataframe_parallel, input_gff, parse_workers,
+                                vocabulary)
+        return profiler.run('read_gff_as_dataframe', read_gff_as_dataframe,
+                            profiler.iterate('process_gff_file', process_gff_file(input_gff, fasta_writer)),
+                            vocabulary)
+
+    if engine == 'stream' and incremental:
+        profiler.run('incremental_convert', incremental_convert, input_gff, output_gff, contig_order, contig_list,
+                     bgzip, index, profiler, fasta_out, vocabulary)
+
+    elif engine == 'stream':
+        profiler.run('stream_convert', stream_convert, input_gff, output_gff, contig_order, contig_list,
+                     bgzip, index, profiler, fasta_out, columnar_out, columnar_format, vocabulary)
+
+    else:
+        import_pandas()  # Not part of the profiled stages
+
+        if fasta_out:
+            # The fasta is extracted while the file is read
+            with BgzfFastaWriter(fasta_out) as fasta_writer:
+                gff_df = read_gff(fasta_writer)
+        else:
+            gff_df = read_gff()
+
+        contig_ranks = contig_order_index(gff_df['SeqName'], contig_order, contig_list)
+
+        converted_df = profiler.run('convert_df', convert_df, gff_df)
+
+        reordered_df = profiler.run('reorder_gff', reorder_gff, converted_df, contig_ranks)
+
+        non_coding_adjusted = profiler.run('non_coding_rna', non_coding_rna, reordered_df)
+
+        profiler.run('write_gff_to_file', write_gff_to_file, non_coding_adjusted, output_gff, bgzip, index)
+
+        if columnar_out:
+            profiler.run('write_columnar', write_columnar, non_coding_adjusted, columnar_out, columnar_format)
+
+    if cache_dir:
+        profiler.run('store_cached_output', store_cached_output, cache_dir, key, outputs, parse_size(cache_size))
+
+    if profile:
+        profiler.write(profile, input=input_gff, output=output_gff, engine=engine, vocabulary=vocabulary.sizes())
+    return False
+
+
+def find_gff_files(source, output_dir, output_extension='.gff'):
+    """
+    This function lists the gff files of a batch run. The source can be a
+    directory (all *.gff and *.gff3 files in it), a glob pattern, or a
+    manifest file with one input gff per line and optionally a tab
+    separated output path.
+
+    Returns: list of (input gff, output gff) pairs
+    """
+    if os.path.isdir(source):
+        inputs = [os.path.join(source, name) for name in sorted(os.listdir(source))
+                  if is_gff_file_name(name)]
+    elif os.path.isfile(source) and not is_gff_file_name(source):
+        pairs = []
+        with open(source, 'r') as manifest:
+            for line in manifest:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                fields = line.split('\t')
+                if len(fields) > 1:
+                    pairs.append((fields[0], fields[1]))
+                else:
+                    pairs.append((fields[0], batch_output_path(fields[0], output_dir, output_extension)))
+        return pairs
+    else:
+        inputs = sorted(glob.glob(source))
+
+    return [(input_gff, batch_output_path(input_gff, output_dir, output_extension)) for input_gff in inputs]
+
+
+def strip_compression_extension(name):
+    """
+    This function removes the compression extension of a file name,
+    e.g. SGB4837.gff.gz becomes SGB4837.gff
+    """
+    for extension in COMPRESSED_EXTENSIONS:
+        if name.endswith(extension):
+            return name[:-len(extension)]
+    return name
+
+
+def is_gff_file_name(name):
+    """
+    This function tells if a file name looks like a (compressed) gff file.
+    """
+    return strip_compression_extension(name).endswith(GFF_EXTENSIONS)
+
+
+def batch_output_path(input_gff, output_dir, output_extension='.gff'):
+    """
+    This function names the output of a batch conversion after its input,
+    e.g. SGB4837.gff becomes <output_dir>/SGB4837_vep.gff
+    """
+    name = strip_compression_extension(os.path.basename(input_gff))
+    for extension in GFF_EXTENSIONS:
+        if name.endswith(extension):
+            name = name[:-len(extension)]
+            break
+    return os.path.join(output_dir, name + '_vep' + output_extension)
+
+
+def batch_item_options(input_gff, output_gff, options):
+    """
+    This function adapts the options of a batch to one of its files: the
+    profile, fasta and columnar outputs are named after the file.
+
+    Returns: dictionary of convert_gff options
+    """
+    if options.get('profile'):
+        options = {**options, 'profile': output_gff + '.profile.json'}
+    if options.get('fasta_out'):
+        options = {**options, 'fasta_out': batch_output_path(input_gff, options['fasta_out'], '.fa.gz')}
+    if options.get('columnar_out'):
+        extension = COLUMNAR_FORMATS[options.get('columnar_format', 'parquet')]
+        options = {**options, 'columnar_out': batch_output_path(input_gff, options['columnar_out'], extension)}
+    return options
+
+
+def batch_collisions(pairs, options):
+    """
+    This function finds the outputs of a batch that several inputs would
+    write, e.g. a.gff and a.gff.gz of the same directory both give a_vep.gff.
+
+    Returns: dictionary mapping every such output to its inputs
+    """
+    inputs = collections.defaultdict(list)
+    for input_gff, output_gff in pairs:
+        item_options = batch_item_options(input_gff, output_gff, options)
+        for path in (output_gff, item_options.get('fasta_out'), item_options.get('columnar_out')):
+            if path:
+                inputs[os.path.normpath(path)].append(input_gff)
+    return {path: files for path, files in inputs.items() if len(files) > 1}
+
+
+def convert_batch_item(task):
+    """
+    This function runs one conversion of a batch in a worker process and
+    catches its errors, so that a broken file does not stop the batch.
+
+    Returns: (input gff, output gff, status (ok, cached or failed), seconds, error message)
+    """
+    input_gff, output_gff, options = task
+    options = batch_item_options(input_gff, output_gff, options)
+    started = time.perf_counter()
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            cached = convert_gff(input_gff, output_gff, **options)
+    except Exception as error:
+        return input_gff, output_gff, 'failed', time.perf_counter() - started, f"{type(error).__name__}: {error}"
+    return input_gff, output_gff, 'cached' if cached else 'ok', time.perf_counter() - started, ''
+
+
+def run_batch(tasks, workers=None):
+    """
+    This function runs the conversions of a batch in a pool of worker
+    processes and yields their results as they complete. Only two tasks per
+    worker are submitted at a time: when a worker process dies (e.g. killed
+    when out of memory) the pool breaks, its tasks are run again one at a
+    time, and a new pool takes over the rest of the batch. Only a file whose
+    worker dies on its own is reported as failed.
+
+    Returns: a generator of convert_batch_item results
+    """
+    workers = workers or os.cpu_count() or 1
+    tasks = iter(tasks)
+    while True:
+        broken = []
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(convert_batch_item, task): task
+                       for task in itertools.islice(tasks, 2 * workers)}
+            while futures:
+                done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    task = futures.pop(future)
+                    try:
+                        yield future.result()
+                    except concurrent.futures.BrokenExecutor:
+                        broken.append(task)
+                if not broken:
+                    for task in itertools.islice(tasks, len(done)):
+                        futures[executor.submit(convert_batch_item, task)] = task
+
+        if not broken:
+            return
+        for task in broken:
+            started = time.perf_counter()
+            with concurrent.futures.ProcessPoolExecutor(max_workers=1) as executor:
+                try:
+                    yield executor.submit(convert_batch_item, task).result()
+                except concurrent.futures.BrokenExecutor as error:
+                    input_gff, output_gff, _ = task
+                    yield (input_gff, output_gff, 'failed', time.perf_counter() - started,
+                           f"{type(error).__name__}: {error}")
+
+
+def convert_batch(pairs, workers=None, summary_file=None, **options):
+    """
+    This function converts many gff files in parallel in a pool of worker
+    processes (see run_batch) and writes a per-file summary (tab separated:
+    input, output, status, seconds, error) as the conversions complete.
+
+    Returns: number of failed conversions
+    """
+    collisions = batch_collisions(pairs, options)
+    if collisions:
+        raise ValueError('several inputs would be written to the same output: ' +
+                         '; '.join(f"{path} ({', '.join(files)})" for path, files in collisions.items()))
+
+    print(f"Converting {len(pairs)} GFF files with {workers or os.cpu_count()} workers ...\n")
+    for directory in ('fasta_out', 'columnar_out'):
+        if options.get(directory):
+            os.makedirs(options[directory], exist_ok=True)
+    tasks = [(input_gff, output_gff, options) for input_gff, output_gff in pairs]
+    for _, output_gff in pairs:
+        output_dir = os.path.dirname(output_gff)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+
+    failed = 0
+    with open(summary_file, 'w') if summary_file else contextlib.nullcontext() as summary_f:
+        for input_gff, output_gff, status, seconds, error in run_batch(tasks, workers):
+            line = f"{input_gff}\t{output_gff}\t{status}\t{seconds:.3f}\t{error}"
+            if status == 'failed':
+                failed += 1
+                print(line)
+            if summary_f:
+                summary_f.write(line + '\n')
+                summary_f.flush()
+
+    print(f"\n{len(pairs) - failed} GFF files converted, {failed} failed.")
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert prokka GFF to VEP-friendly GFF')
+    parser.add_argument('--gff', help='Input GFF file path')
+    parser.add_argument('--out', help='Output file path')
+    parser.add_argument('--batch', help='Convert many GFF files: a directory, a quoted glob pattern or a manifest '
+                                        'with one input GFF (and optionally a tab separated output path) per line')
+    parser.add_argument('--outdir', help='Output directory of the batch conversion')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of worker processes of the batch conversion (default: all cores)')
+    parser.add_argument('--summary', help='Per-file summary of the batch conversion (default: <outdir>/prokka2vep_summary.tsv)')
+    parser.add_argument('--engine', choices=['stream', 'pandas'], default='stream',
+                        help='Conversion engine: a single-pass stream using only the standard library, '
+                             'or pandas dataframes (default: stream)')
+    parser.add_argument('--contig-order', choices=['natural', 'input'], default='natural',
+                        help='Order of the contigs in the output: natural sort of the names or input order (default: natural)')
+    parser.add_argument('--contig-list', help='Contig order from a .fai index, a GFF with ##sequence-region headers '
+                                              'or a file with one contig name per line')
+    parser.add_argument('--bgzip', action='store_true',
+                        help='Write a BGZF compressed GFF with its tabix index, ready for VEP --gff')
+    parser.add_argument('--index', choices=['tbi', 'csi', 'none'], default='tbi',
+                        help='Index written next to the --bgzip output (default: tbi)')
+    parser.add_argument('--parse-workers', type=int, default=1,
+                        help='Worker processes parsing an uncompressed GFF with --engine pandas (default: 1)')
+    parser.add_argument('--profile', nargs='?', const='-',
+                        help='Write the time, CPU, peak memory and rows of every stage as a JSON report to this path '
+                             '(stderr without a path; <output>.profile.json for each file of a batch)')
+    parser.add_argument('--cache-dir', help='Copy the outputs of inputs already converted with the same options '
+                                            'from this cache directory instead of converting them again')
+    parser.add_argument('--cache-size', type=parse_size, default='10G',
+                        help='Maximum size of the cache, the least recently used entries are evicted (default: 10G)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only convert again the contigs that changed since the previous --incremental conversion '
+                             'to the same output, and copy the others from it (stream engine only)')
+    parser.add_argument('--columnar-out', help='Also write the converted records to this Parquet or Arrow file '
+                                               '(a directory in batch mode), requires pyarrow')
+    parser.add_argument('--columnar-format', choices=list(COLUMNAR_FORMATS), default='parquet',
+                        help='Format of --columnar-out: Parquet or Arrow IPC (default: parquet)')
+    parser.add_argument('--fasta-out', help='Extract the ##FASTA sequences to this BGZF compressed fasta with its '
+                                            '.fai and .gzi indexes (a directory in batch mode), ready for VEP --fasta')
+
+    args = parser.parse_args()
+
+    contig_list = read_contig_list(args.contig_list) if args.contig_list else None
+    options = {'engine': args.engine, 'contig_order': args.contig_order, 'contig_list': contig_list,
+               'bgzip': args.bgzip, 'index': None if args.index == 'none' else args.index, 'profile': args.profile,
+               'parse_workers': args.parse_workers, 'fasta_out': args.fasta_out, 'cache_dir': args.cache_dir,
+               'cache_size': args.cache_size, 'incremental': args.incremental, 'columnar_out': args.columnar_out,
+               'columnar_format': args.columnar_format}
 
-    reordered_df = reorder_gff(merged_df)
+    if args.incremental and args.engine != 'stream':
+        parser.error('--incremental requires --engine stream')
+    if args.incremental and args.columnar_out:
+        parser.error('--columnar-out cannot be combined with --incremental')
 
-    non_coding_adjusted = non_coding_rna(reordered_df)
+    if args.batch:
+        if not args.outdir:
+            parser.error('--batch requires --outdir')
+        pairs = find_gff_files(args.batch, args.outdir, '.gff.gz' if args.bgzip else '.gff')
+        if not pairs:
+            parser.error(f'no GFF files found in {args.batch}')
+        os.makedirs(args.outdir, exist_ok=True)
+        summary_file = args.summary or os.path.join(args.outdir, 'prokka2vep_summary.tsv')
+        try:
+            failed = convert_batch(pairs, args.workers, summary_file, **options)
+        except ValueError as error:
+            parser.error(str(error))
+        sys.exit(1 if failed else 0)
 
-    write_gff_to_file(non_coding_adjusted, output_gff)
+    if not args.gff or not args.out:
+        parser.error('--gff and --out are required (or --batch and --outdir)')
 
-    os.remove(output_gff+'.tmp')
+    convert_gff(args.gff, args.out, **options)
 
 if __name__ == "__main__":
     main()
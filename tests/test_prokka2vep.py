@@ -0,0 +1,148 @@
+"""
+Description: End-to-end tests of prokka2vep on synthetic prokka GFF files (see benchmark.generate_prokka_gff).
+The BGZF outputs and their tabix/csi, fai and gzi indexes are read back with pysam (htslib).
+Usage: python -m pytest tests
+"""
+
+import gzip
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'prokka2vep'))
+
+import prokka2vep  # noqa: E402
+from benchmark import generate_prokka_gff  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def prokka_gff(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('input') / 'synthetic.gff')
+    generate_prokka_gff(path, 3000, n_contigs=12, seed=1)
+    return path
+
+
+@pytest.fixture(scope='module')
+def converted_gff(prokka_gff, tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('reference') / 'synthetic_vep.gff')
+    prokka2vep.convert_gff(prokka_gff, path)
+    return path
+
+
+def read_text(path):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt') as input_f:
+        return input_f.read()
+
+
+def assert_tabix_queries(path, index, expected_text, queries=200):
+    """
+    This function checks random region queries of an indexed BGZF gff against
+    the records of the expected gff that overlap the region.
+    """
+    pysam = pytest.importorskip('pysam')
+    records = [line.split('\t') for line in expected_text.splitlines()]
+    contigs = sorted({record[0] for record in records})
+    rng = random.Random(0)
+    with pysam.TabixFile(path, index=f'{path}.{index}') as tabix:
+        assert sorted(tabix.contigs) == contigs
+        for _ in range(queries):
+            contig = rng.choice(contigs)
+            start = rng.randint(1, 300000)
+            end = start + rng.choice([1, 100, 5000, 40000, 300000])
+            expected = ['\t'.join(record) for record in records
+                        if record[0] == contig and int(record[3]) <= end and int(record[4]) >= start]
+            assert list(tabix.fetch(contig, start - 1, end)) == expected, (contig, start, end)
+
+
+@pytest.mark.parametrize('contig_order', ['natural', 'input'])
+def test_stream_and_pandas_engines_match(prokka_gff, tmp_path, contig_order):
+    pytest.importorskip('pandas')
+    stream_out = str(tmp_path / 'stream.gff')
+    pandas_out = str(tmp_path / 'pandas.gff')
+    prokka2vep.convert_gff(prokka_gff, stream_out, engine='stream', contig_order=contig_order)
+    prokka2vep.convert_gff(prokka_gff, pandas_out, engine='pandas', contig_order=contig_order)
+    assert read_text(stream_out)
+    assert read_text(stream_out) == read_text(pandas_out)
+
+
+@pytest.mark.parametrize('engine', ['stream', 'pandas'])
+@pytest.mark.parametrize('index', ['tbi', 'csi'])
+def test_bgzip_output_is_indexed(prokka_gff, converted_gff, tmp_path, engine, index):
+    if engine == 'pandas':
+        pytest.importorskip('pandas')
+    output = str(tmp_path / 'synthetic_vep.gff.gz')
+    prokka2vep.convert_gff(prokka_gff, output, engine=engine, bgzip=True, index=index)
+    expected = read_text(converted_gff)
+    assert read_text(output) == expected
+    assert_tabix_queries(output, index, expected)
+
+
+def test_fasta_out_is_indexed(prokka_gff, tmp_path):
+    pysam = pytest.importorskip('pysam')
+    fasta_out = str(tmp_path / 'synthetic_vep.fa.gz')
+    prokka2vep.convert_gff(prokka_gff, str(tmp_path / 'synthetic_vep.gff'), fasta_out=fasta_out)
+
+    sequences = {}
+    with open(prokka_gff) as input_f:
+        name = None
+        for line in input_f:
+            if line.startswith('>'):
+                name = line[1:].split()[0]
+                sequences[name] = []
+            elif name is not None:
+                sequences[name].append(line.strip())
+    sequences = {name: ''.join(lines) for name, lines in sequences.items()}
+
+    assert os.path.exists(fasta_out + '.fai') and os.path.exists(fasta_out + '.gzi')
+    with pysam.FastaFile(fasta_out) as fasta:
+        assert list(fasta.references) == list(sequences)
+        for name, sequence in sequences.items():
+            assert fasta.get_reference_length(name) == len(sequence)
+            assert fasta.fetch(name) == sequence
+            assert fasta.fetch(name, 1000, 1100) == sequence[1000:1100]
+
+
+@pytest.mark.parametrize('bgzip', [False, True])
+def test_incremental_conversion_matches_full_conversion(prokka_gff, tmp_path, bgzip):
+    output = str(tmp_path / ('synthetic_vep.gff.gz' if bgzip else 'synthetic_vep.gff'))
+    assert prokka2vep.convert_gff(prokka_gff, output, bgzip=bgzip, incremental=True) is False
+
+    # Change the attributes of one feature (with non-ASCII text) of a single contig
+    with open(prokka_gff) as input_f:
+        lines = input_f.readlines()
+    changed = next(number for number, line in enumerate(lines) if line.startswith('contig_3\t') and '\tCDS\t' in line)
+    lines[changed] = lines[changed].rstrip('\n') + ';note=édité\n'
+    edited_gff = str(tmp_path / 'edited.gff')
+    with open(edited_gff, 'w') as output_f:
+        output_f.writelines(lines)
+
+    assert prokka2vep.incremental_convert(edited_gff, output, bgzip=bgzip) == 1
+    reference = str(tmp_path / ('reference.gff.gz' if bgzip else 'reference.gff'))
+    prokka2vep.convert_gff(edited_gff, reference, bgzip=bgzip)
+
+    expected = read_text(reference)
+    assert read_text(output) == expected
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.tmp')]
+    if bgzip:
+        assert_tabix_queries(output, 'tbi', expected)
+
+
+def test_cache_copies_and_evicts(prokka_gff, converted_gff, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    first = str(tmp_path / 'first.gff')
+    second = str(tmp_path / 'second.gff')
+    assert prokka2vep.convert_gff(prokka_gff, first, cache_dir=cache_dir) is False
+    assert prokka2vep.convert_gff(prokka_gff, second, cache_dir=cache_dir) is True
+    assert read_text(second) == read_text(converted_gff)
+
+    # Another option is another cache entry
+    assert prokka2vep.convert_gff(prokka_gff, first, cache_dir=cache_dir, contig_order='input') is False
+    assert len(os.listdir(cache_dir)) == 2
+
+    prokka2vep.evict_cache(cache_dir, os.path.getsize(first) + 1)
+    assert len(os.listdir(cache_dir)) == 1
+    prokka2vep.evict_cache(cache_dir, 0)
+    assert os.listdir(cache_dir) == []